@@ -1,7 +1,12 @@
+import os
+import gzip
 import argparse
-from itertools import izip
-from xml.sax.saxutils import escape
+import json
+from itertools import izip, groupby
+from xml.sax.saxutils import escape, quoteattr
 import re
+from output import OutputWriter
+import instrument
 
 def read_documents(align_dir):
     sentences = []
@@ -28,16 +33,214 @@ def should_keep(text):
     if r < 0.8: return False
     return True
 
+class BitextWriter(object):
+    '''Writes aligned documents through buffered outputs.
+
+    `prefix`            Output file prefix (stdout if None)
+    `compress`          Gzip the output
+    `shard_articles`    Start new output files after this many documents
+    '''
+    suffixes = ('',)
+
+    def __init__(self, src_lang, trg_lang, prefix=None, compress=False, shard_articles=None):
+        self.src_lang = src_lang
+        self.trg_lang = trg_lang
+        self.shard_articles = shard_articles
+        self.n_articles = 0
+        self.outputs = [OutputWriter(prefix, (suffix if prefix else ''), compress,
+            sharded=shard_articles is not None) for suffix in self.suffixes]
+        self.begin()
+
+    def write(self, *data):
+        for out, text in zip(self.outputs, data):
+            out.write(text)
+
+    def begin(self):
+        pass
+
+    def end(self):
+        pass
+
+    def document(self, article_id, info, units):
+        raise NotImplementedError
+
+    def read_documents(self, f):
+        '''Reads an output of this writer -> [(article id, data)]'''
+        raise NotImplementedError
+
+    def _next_document(self):
+        if self.shard_articles and self.n_articles == self.shard_articles:
+            self.end()
+            for out in self.outputs:
+                out.new_shard()
+            self.begin()
+            self.n_articles = 0
+        self.n_articles += 1
+
+    def write_document(self, article_id, info, sentences):
+        units = []
+        for i, (src_sentence, trg_sentence) in enumerate(sentences, 1):
+            if not (should_keep(src_sentence) and should_keep(trg_sentence)):
+                continue
+            units.append((i, LANG.sub('', src_sentence), LANG.sub('', trg_sentence)))
+        self._next_document()
+        self.document(article_id, info, units)
+
+    def copy_documents(self, path, skip):
+        '''Copies the documents of a previous output except the ones
+        whose id is in `skip` -> number of documents copied'''
+        n = 0
+        with (gzip.open if path.endswith('.gz') else open)(path, 'rb') as f:
+            for article_id, data in self.read_documents(f):
+                if article_id in skip:
+                    continue
+                self._next_document()
+                self.write(data)
+                n += 1
+        return n
+
+    def close(self):
+        self.end()
+        for out in self.outputs:
+            out.close()
+
+class XMLWriter(BitextWriter):
+    suffixes = ('.xml',)
+    file_tag = re.compile(r'<file languages="[^"]*" id="(\d+)">')
+
+    def read_documents(self, f):
+        article_id, lines = None, []
+        for line in f:
+            if article_id is None:
+                m = self.file_tag.match(line)
+                if m:
+                    article_id, lines = int(m.group(1)), [line]
+            else:
+                lines.append(line)
+                if line == '</file>\n':
+                    yield article_id, ''.join(lines)
+                    article_id = None
+
+    def begin(self):
+        self.write('<?xml version="1.0" encoding="utf-8"?>\n<dataset>\n')
+
+    def end(self):
+        self.write('</dataset>\n')
+
+    def document(self, article_id, info, units):
+        src_lang, trg_lang = self.src_lang, self.trg_lang
+        src_url, trg_url, date = info
+        lines = ['<file languages="{},{}" id="{}">'.format(src_lang, trg_lang, article_id),
+            '<metadata url_{}="{}" url_{}="{}" date="{}"/>'.format(src_lang,
+                src_url, trg_lang, trg_url, date),
+            '  <data>']
+        for i, src_sentence, trg_sentence in units:
+            lines.append('    <unit sentence="{}">'.format(i))
+            lines.append('      <align>')
+            for lang, sentence in ((src_lang, src_sentence), (trg_lang, trg_sentence)):
+                lines.append('        <text langid="{}">'.format(lang))
+                lines.append('          <s>{}</s>'.format(escape(sentence).encode('utf8')))
+                lines.append('        </text>')
+            lines.append('      </align>')
+            lines.append('    </unit>')
+        lines.append('  </data>')
+        lines.append('</file>')
+        lines.append('')
+        self.write('\n'.join(lines))
+
+class TMXWriter(BitextWriter):
+    suffixes = ('.tmx',)
+
+    def read_documents(self, f):
+        # One line per unit, with the id of the article in its tuid
+        units = (line for line in f if line.startswith('<tu tuid="'))
+        for article_id, lines in groupby(units, lambda line: int(line[10:line.index('-')])):
+            yield article_id, ''.join(lines)
+
+    def begin(self):
+        self.write('<?xml version="1.0" encoding="utf-8"?>\n<tmx version="1.4">\n'
+            '<header creationtool="gv-crawl" creationtoolversion="1" datatype="plaintext"'
+            ' segtype="sentence" adminlang="en" srclang={} o-tmf="none"/>\n<body>\n'.format(
+                quoteattr(self.src_lang)))
+
+    def end(self):
+        self.write('</body>\n</tmx>\n')
+
+    def document(self, article_id, info, units):
+        src_url, trg_url, date = info
+        props = ''.join('<prop type={}>{}</prop>'.format(quoteattr(name), escape(value))
+                for name, value in (('article', str(article_id)), ('url-'+self.src_lang, src_url),
+                    ('url-'+self.trg_lang, trg_url), ('date', date)))
+        lines = []
+        for i, src_sentence, trg_sentence in units:
+            lines.append('<tu tuid="{}-{}">{}'.format(article_id, i, props))
+            for lang, sentence in ((self.src_lang, src_sentence), (self.trg_lang, trg_sentence)):
+                lines.append('<tuv xml:lang={}><seg>{}</seg></tuv>'.format(quoteattr(lang),
+                    escape(sentence).encode('utf8')))
+            lines.append('</tu>\n')
+        self.write(''.join(lines))
+
+class JSONLinesWriter(BitextWriter):
+    suffixes = ('.jsonl',)
+
+    def read_documents(self, f):
+        for article_id, lines in groupby(f, lambda line: json.loads(line)['id']):
+            yield article_id, ''.join(lines)
+
+    def document(self, article_id, info, units):
+        src_url, trg_url, date = info
+        self.write(''.join(json.dumps({'id': article_id, 'sentence': i, 'date': date,
+            'url_'+self.src_lang: src_url, 'url_'+self.trg_lang: trg_url,
+            self.src_lang: src_sentence, self.trg_lang: trg_sentence},
+            ensure_ascii=False, sort_keys=True).encode('utf8')+'\n'
+            for i, src_sentence, trg_sentence in units))
+
+class TextWriter(BitextWriter):
+    '''Parallel {prefix}.src and {prefix}.trg files with one sentence per line'''
+    suffixes = ('.src', '.trg')
+
+    def document(self, article_id, info, units):
+        self.write(''.join(src.encode('utf8')+'\n' for _, src, _ in units),
+                ''.join(trg.encode('utf8')+'\n' for _, _, trg in units))
+
+writers = {'xml': XMLWriter, 'tmx': TMXWriter, 'jsonl': JSONLinesWriter, 'text': TextWriter}
+
+def add_output_arguments(parser):
+    parser.add_argument('--format', choices=sorted(writers), default='xml',
+            help='output format')
+    parser.add_argument('--output', help='output file prefix (default: stdout)')
+    parser.add_argument('--gzip', action='store_true', help='compress the output')
+    parser.add_argument('--shard-articles', type=int,
+            help='start a new output file after this many articles (requires --output)')
+
+def make_writer(parser, args, src_lang, trg_lang):
+    if (args.shard_articles or args.format == 'text') and not args.output:
+        parser.error('--shard-articles and --format text require --output')
+    return writers[args.format](src_lang, trg_lang, args.output, args.gzip,
+            args.shard_articles)
+
 def main():
     parser = argparse.ArgumentParser(description='Convert aligned articles to XML')
     parser.add_argument('src_lang', help='ISO code for source language - original [eng]')
     parser.add_argument('trg_lang', help='ISO code for target language - translated [swa]')
     parser.add_argument('info_file', help='align_info.txt file path')
     parser.add_argument('align_dir', help='output_data_aligned directory')
+    add_output_arguments(parser)
+    parser.add_argument('--merge', nargs='+', metavar='FILE',
+            help='previous output files (same format) whose articles are copied to the output, '
+            'except the ones which are in the new alignments')
+    instrument.add_arguments(parser)
     args = parser.parse_args()
+    instrument.start(args)
+
+    if args.merge:
+        if args.format == 'text':
+            parser.error('--merge is not available with --format text')
+        if args.output and any(os.path.abspath(fn).startswith(os.path.abspath(args.output)+'.')
+                for fn in args.merge):
+            parser.error('the files given to --merge cannot be overwritten by --output')
 
-    src_lang = args.src_lang
-    trg_lang = args.trg_lang
+    writer = make_writer(parser, args, args.src_lang, args.trg_lang)
 
     doc_info = {}
     with open(args.info_file) as f_doc_info:
@@ -46,30 +249,17 @@ def main():
             article_id = int(article_id)
             doc_info[article_id] = (src_url, trg_url, date)
 
-    print('<?xml version="1.0" encoding="utf-8"?>')
-    print('<dataset>')
-    for article_id, sentences in read_documents(args.align_dir):
-        print('<file languages="{},{}" id="{}">'.format(src_lang, trg_lang, article_id))
-        src_url, trg_url, date = doc_info[article_id]
-        print('<metadata url_{}="{}" url_{}="{}" date="{}"/>'.format(src_lang,
-            src_url, trg_lang, trg_url, date))
-        print('  <data>')
-        for i, (src_sentence, trg_sentence) in enumerate(sentences, 1):
-            if not (should_keep(src_sentence) and should_keep(trg_sentence)):
-                continue
-            src_sentence = LANG.sub('', src_sentence)
-            trg_sentence = LANG.sub('', trg_sentence)
-            print('    <unit sentence="{}">'.format(i))
-            print('      <align>')
-            for lang, sentence in ((src_lang, src_sentence), (trg_lang, trg_sentence)):
-                print('        <text langid="{}">'.format(lang))
-                print('          <s>{}</s>'.format(escape(sentence).encode('utf8')))
-                print('        </text>')
-            print('      </align>')
-            print('    </unit>')
-        print('  </data>')
-        print('</file>')
-    print('</dataset>')
+    # Articles of the previous outputs which were not aligned again
+    for fn in args.merge or []:
+        with instrument.stage('merge'):
+            writer.copy_documents(fn, doc_info)
+
+    for article_id, sentences in instrument.timed_iter('read', read_documents(args.align_dir)):
+        with instrument.stage('write'):
+            writer.write_document(article_id, doc_info[article_id], sentences)
+        instrument.count('documents')
+        instrument.count('sentences', len(sentences))
+    writer.close()
 
 if __name__ == '__main__':
     main()
@@ -0,0 +1,75 @@
+'''
+Length-based sentence alignment (Gale & Church, 1993).
+
+The dynamic program is computed one anti-diagonal at a time: all the cells
+of an anti-diagonal only depend on the previous ones, so each step is a
+handful of NumPy operations.
+'''
+import numpy
+
+# (source sentences, target sentences, prior probability) of each bead type
+beads = ((1, 1, 0.89), (1, 0, 0.0099/2), (0, 1, 0.0099/2),
+         (2, 1, 0.089/2), (1, 2, 0.089/2), (2, 2, 0.011))
+
+# Expected ratio of target to source length and its variance
+MEAN = 1.0
+VARIANCE = 6.8
+
+def match_cost(l1, l2):
+    '''-log P(match | source length l1, target length l2) for arrays of lengths'''
+    mean = numpy.maximum((l1 + l2 / MEAN) / 2.0, 1e-6)
+    z = numpy.abs((MEAN * l1 - l2) / numpy.sqrt(mean * VARIANCE))
+    # Normal cumulative distribution (Abramowitz & Stegun 26.2.17)
+    t = 1 / (1 + 0.2316419 * z)
+    poly = ((((1.330274429 * t - 1.821255978) * t + 1.781477937) * t
+        - 0.356563782) * t + 0.319381530) * t
+    pd = 2 * 0.3989423 * numpy.exp(-z * z / 2) * poly
+    return -numpy.log(numpy.maximum(pd, 1e-300))
+
+def align(src_lengths, trg_lengths):
+    '''Aligns two sequences of sentence lengths -> [(i0, i1, j0, j1)]
+    where source sentences i0:i1 are aligned with target sentences j0:j1'''
+    n, m = len(src_lengths), len(trg_lengths)
+    S = numpy.concatenate(([0], numpy.cumsum(src_lengths, dtype=float)))
+    T = numpy.concatenate(([0], numpy.cumsum(trg_lengths, dtype=float)))
+    priors = [-numpy.log(p) for _, _, p in beads]
+    D = numpy.full((n + 1, m + 1), numpy.inf)
+    B = numpy.zeros((n + 1, m + 1), dtype=numpy.int8)
+    D[0, 0] = 0
+    for k in xrange(1, n + m + 1):
+        I = numpy.arange(max(0, k - m), min(n, k) + 1)
+        J = k - I
+        best = numpy.full(len(I), numpy.inf)
+        best_bead = numpy.zeros(len(I), dtype=numpy.int8)
+        for b, (di, dj, _) in enumerate(beads):
+            valid = (I >= di) & (J >= dj)
+            if not valid.any():
+                continue
+            i, j = I[valid], J[valid]
+            cost = (D[i - di, j - dj] + priors[b]
+                    + match_cost(S[i] - S[i - di], T[j] - T[j - dj]))
+            better = cost < best[valid]
+            idx = numpy.flatnonzero(valid)[better]
+            best[idx] = cost[better]
+            best_bead[idx] = b
+        D[I, J] = best
+        B[I, J] = best_bead
+    # Backtrack from the last cell
+    alignment = []
+    i, j = n, m
+    while i > 0 or j > 0:
+        di, dj, _ = beads[B[i, j]]
+        alignment.append((i - di, i, j - dj, j))
+        i, j = i - di, j - dj
+    alignment.reverse()
+    return alignment
+
+def align_sentences(src_sentences, trg_sentences):
+    '''Aligns two lists of sentences -> [(source text, target text)]
+
+    Sentences which are not aligned with anything are dropped and
+    sentences in the same bead are joined with a space.
+    '''
+    alignment = align([len(s) for s in src_sentences], [len(s) for s in trg_sentences])
+    return [(' '.join(src_sentences[i0:i1]), ' '.join(trg_sentences[j0:j1]))
+            for i0, i1, j0, j1 in alignment if i1 > i0 and j1 > j0]
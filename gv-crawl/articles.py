@@ -1,31 +1,48 @@
 import re
 from collections import namedtuple
 import lxml.html
-import numpy
-import langid
-
-# Fix langid probability normalization
-langid.langid.load_model()
-langid.langid.identifier.norm_probs = lambda vals: numpy.exp(vals - numpy.logaddexp.reduce(vals))
+from lxml.cssselect import CSSSelector
+import langident
+import instrument
 
 Article = namedtuple('Article', 'url, id, lang, metadata, translations, source, title, entry')
 url_pattern = re.compile('http://([a-z]+\.)?globalvoicesonline\.org')
 
+# Selectors are translated to XPath once
+select_title = CSSSelector('h2.post-title', translator='html')
+select_entry = CSSSelector('#main-wrapper div.entry', translator='html')
+select_source = CSSSelector('span.source-link > a', translator='html')
+select_translations = CSSSelector('div.post-translations a', translator='html')
+
 block_elements = set(('address', 'blockquote', 'dd', 'div', 'dl', 'dt', 'dd',
     'fieldset', 'form', 'h1', 'h2', 'h3', 'h4', 'h5', 'h6', 'hr',
     'noscript', 'ol', 'p', 'pre', 'section', 'table', 'tfoot',
     'ul', 'li', 'video', 'br', 'center', 'img', 'tr', 'td', 'th'))
 
+def article_date(metadata):
+    """Publication date from the body classes (s-yYYYY s-mMM s-dDD) -> (y, m, d) or None"""
+    date = {}
+    for item in (metadata or '').split():
+        if item[:3] in ('s-y', 's-m', 's-d') and item[3:].isdigit():
+            date[item[2]] = int(item[3:])
+    if len(date) < 3: return None
+    return date['y'], date['m'], date['d']
+
 twitter = re.compile('(@|#)\w+')
 
 def is_foreign(text, lang):
-    plang, pconf = langid.classify(twitter.sub('', text))
+    plang, pconf = langident.classify(twitter.sub('', text))
     return (plang != lang or pconf < 0.9)
 
+foreign_classes = ('rtl', 'hebrew', 'arabic')
+
+def is_quote_candidate(e):
+    return e.tag == 'blockquote' or e.get('class') == 'translation'
+
 def is_foreign_quote(e, lang):
     cls = e.get('class')
-    if cls in ('rtl', 'hebrew', 'arabic'): return True
-    if e.tag == 'blockquote' or e.get('class') == 'translation':
+    if cls in foreign_classes: return True
+    if is_quote_candidate(e):
         return is_foreign(e.text_content(), lang)
     return False
 
@@ -48,11 +65,65 @@ def _clean_foreign(e, lang):
 def clean_foreign(e, lang):
     return list(_clean_foreign(e, lang))
 
-def get_text(e, lang):
+def get_text_reference(e, lang):
+    """
+    Previous implementation of get_text, which modifies the tree and
+    classifies every quotation on its own. Kept to check that get_text
+    gives the same results (test_articles.py, benchmark.py --check).
+    """
     clean_foreign(e, lang)
     return '\n'.join(line.strip() for line in e.text_content().split('\n') if line.strip())
 
-def process_article(record):
+def _walk(e, pieces, quotes):
+    """
+    Append the text of the descendants of e to pieces, with None for the new
+    lines around block elements, and append (start, end, stop, block, always
+    foreign) to quotes for the quote candidates: pieces[start:end] is the
+    text of the element and pieces[start:stop] also covers its tail.
+    """
+    for c in e:
+        if not isinstance(c.tag, basestring): # comments and processing instructions
+            if c.tail: pieces.append(c.tail)
+            continue
+        block = c.tag in block_elements
+        start = len(pieces)
+        if block: pieces.append(None)
+        if c.text: pieces.append(c.text)
+        _walk(c, pieces, quotes)
+        end = len(pieces)
+        if block: pieces.append(None)
+        if c.tail: pieces.append(c.tail)
+        if c.get('class') in foreign_classes:
+            quotes.append((start, end, len(pieces), block, True))
+        elif is_quote_candidate(c):
+            quotes.append((start, end, len(pieces), block, False))
+
+def get_text(e, lang):
+    """
+    Text of an element without its foreign quotations, one line per block.
+    The tree is walked once and left unchanged; the quotations are
+    identified in one batch.
+    """
+    pieces, quotes = [], []
+    _walk(e, pieces, quotes)
+    # Quotes are classified on their own text, with a new line first for blocks
+    candidates = [q for q in quotes if not q[4]]
+    texts = [twitter.sub('', ('\n' if block else '')
+        + ''.join(p for p in pieces[start+block:end] if p is not None))
+        for start, end, _, block, _ in candidates]
+    foreign = [q for q in quotes if q[4]]
+    for (plang, pconf), q in zip(langident.cache.classify_batch(texts), candidates):
+        if plang != lang or pconf < 0.9:
+            foreign.append(q)
+    # Drop foreign quotes with their tails
+    keep = [True] * len(pieces)
+    for start, _, stop, _, _ in foreign:
+        keep[start:stop] = [False] * (stop - start)
+    text = (e.text or '') + ''.join(('\n' if p is None else p)
+            for p, k in zip(pieces, keep) if k)
+    return '\n'.join(line.strip() for line in text.split('\n') if line.strip())
+
+def process_article(record, get_text=get_text):
     # Get URL
     url = record.url
     # Get language
@@ -61,22 +132,24 @@ def process_article(record):
     # Parse HTML
     payload = record.payload.read()
     body = payload[payload.find('\n\r\n'):]
-    doc = lxml.html.document_fromstring(body.decode('utf8'))
+    with instrument.stage('parse'):
+        doc = lxml.html.document_fromstring(body.decode('utf8'))
     # Extract post title and ID
-    h2_title = doc.cssselect('h2.post-title')
+    h2_title = select_title(doc)
     assert len(h2_title) == 1, 'Cannot find title'
     h2_title = h2_title[0]
     post_id = int(h2_title.get('id').split('-')[1])
     title = h2_title.find('a').text.strip()
     # Extract post content
-    div_entry = doc.cssselect('#main-wrapper div.entry')
+    div_entry = select_entry(doc)
     assert len(div_entry) == 1, 'Cannot find entry container (n={})'.format(len(div_entry))
-    entry = get_text(div_entry[0], lang)
+    with instrument.stage('text'):
+        entry = get_text(div_entry[0], lang)
     # Extract source translation
-    source_link = doc.cssselect('span.source-link > a')
+    source_link = select_source(doc)
     source = source_link[0].get('href') if source_link else url
     # Extract translations
-    translations = [a.get('href') for a in doc.cssselect('div.post-translations a')]
+    translations = [a.get('href') for a in select_translations(doc)]
     # Extract metadata
     meta = doc.body.get('class')
     return Article(url, post_id, lang, meta, ' '.join(translations), source, title, entry)
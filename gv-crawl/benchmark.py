@@ -0,0 +1,224 @@
+'''
+Benchmark of the processing steps on a corpus generated by synth.py.
+
+Every step runs in its own process, so that its wall and CPU times and its
+peak memory are measured separately. Results can be saved as JSON and
+compared with the results of another commit.
+'''
+import os
+import sys
+import json
+import time
+import shutil
+import argparse
+import tempfile
+import subprocess
+import StringIO
+import warc_index
+import instrument
+import articles
+from articles import process_article
+
+gv_dir = os.path.dirname(os.path.abspath(__file__))
+stage_names = ('extract', 'warc2db', 'db2bidoc', 'db2xml', 'align2xml', 'db2mono')
+
+def script(name):
+    return [sys.executable, os.path.join(gv_dir, name+'.py')]
+
+def run(command, cwd=None):
+    '''Runs a command -> (wall time, user time, system time, peak memory in MB, stdout)'''
+    with tempfile.TemporaryFile() as out:
+        start = time.time()
+        process = subprocess.Popen(command, stdout=out, cwd=cwd)
+        _, status, usage = os.wait4(process.pid, 0)
+        wall = time.time() - start
+        process.returncode = status # already waited for
+        out.seek(0)
+        output = out.read()
+    if status != 0:
+        raise RuntimeError('{} failed:\n{}'.format(' '.join(command), output))
+    return wall, usage.ru_utime, usage.ru_stime, usage.ru_maxrss / 1024.0, output
+
+def extract(warcs):
+    '''Times the reading of the records and process_article separately'''
+    times = {'read': 0.0, 'process_article': 0.0}
+    n_records = n_errors = 0
+    for fn in warcs:
+        records = warc_index.read_records(fn, 0)
+        while True:
+            start = time.time()
+            try:
+                record, _ = next(records)
+            except StopIteration:
+                break
+            read = time.time()
+            try:
+                process_article(record)
+            except AssertionError:
+                n_errors += 1
+            times['read'] += read - start
+            times['process_article'] += time.time() - read
+            n_records += 1
+    return {'records': n_records, 'errors': n_errors, 'times': times}
+
+def check(warcs):
+    '''Compares the articles extracted by get_text and get_text_reference
+    -> (number of records, number of differences)'''
+    n_records = n_diffs = 0
+    for fn in warcs:
+        for record, _ in warc_index.read_records(fn, 0):
+            n_records += 1
+            payload = record.payload.read()
+            results = []
+            for get_text in (articles.get_text, articles.get_text_reference):
+                record.payload = StringIO.StringIO(payload)
+                try:
+                    results.append(process_article(record, get_text))
+                except AssertionError as e:
+                    results.append(str(e))
+            if results[0] != results[1]:
+                n_diffs += 1
+                print('Different extraction: {}\n{!r}\n{!r}'.format(record.url, *results))
+    return n_records, n_diffs
+
+def list_warcs(corpus):
+    return sorted((os.path.join(corpus, fn) for fn in os.listdir(corpus)
+        if fn.endswith('.warc.gz')), key=lambda fn: int(fn.split('.')[-3]))
+
+def stage_commands(args, manifest, warcs, tmp_dir, db):
+    '''-> {stage: (command, number of items processed)}'''
+    src, trg = args.pair
+    workers = ['--workers', str(args.workers)]
+    commands = {
+        'extract': (script('benchmark') + ['--extract'] + warcs, manifest['records']),
+        'warc2db': (script('warc2db') + warcs + [db, '--force'] + workers, manifest['records']),
+        'db2bidoc': (script('db2bidoc') + [src, trg, db, tmp_dir] + workers,
+            manifest['articles'][trg]),
+        'db2xml': (script('db2xml') + [src, trg, db, '--output', os.path.join(tmp_dir, 'xml')]
+            + workers, manifest['articles'][trg]),
+        'db2mono': (script('db2mono') + [db, trg, '--output', os.path.join(tmp_dir, 'mono')],
+            manifest['articles'][trg]),
+    }
+    aligned = manifest.get('aligned')
+    if aligned:
+        commands['align2xml'] = (script('align2xml') + [aligned['src'], aligned['trg'],
+            os.path.join(args.corpus, 'corpus_to_align', 'align_info.txt'),
+            os.path.join(args.corpus, 'corpus_data', 'output_data_aligned'),
+            '--output', os.path.join(tmp_dir, 'aligned')], aligned['sentences'])
+    return commands
+
+def git_commit():
+    try:
+        return subprocess.check_output(['git', 'rev-parse', '--short', 'HEAD'],
+                cwd=gv_dir).strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+def print_results(results, previous=None):
+    print('{:<10} {:>8} {:>9} {:>10} {:>8} {:>8} {:>9}{}'.format('stage', 'items',
+        'wall (s)', 'items/s', 'user', 'sys', 'peak MB', ' speedup' if previous else ''))
+    for name in stage_names:
+        if name not in results['stages']:
+            continue
+        r = results['stages'][name]
+        line = '{:<10} {:>8} {:>9.2f} {:>10.1f} {:>8.2f} {:>8.2f} {:>9.1f}'.format(name,
+                r['items'], r['wall'], r['rate'], r['user'], r['sys'], r['peak_mb'])
+        if previous and name in previous['stages']:
+            line += ' {:>7.2f}x'.format(previous['stages'][name]['wall'] / r['wall'])
+        print(line)
+        for sub_stage, seconds in sorted(r.get('times', {}).iteritems()):
+            print('  {:<20} {:>9.2f}'.format(sub_stage, seconds))
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark the processing steps')
+    parser.add_argument('corpus', nargs='?', help='directory generated by synth.py')
+    parser.add_argument('--stages', default=','.join(stage_names),
+            help='comma separated steps to run (default: all)')
+    parser.add_argument('--pair', nargs=2, metavar=('SRC', 'TRG'),
+            help='language pair of the bitext steps (default: the --aligned pair of '
+            'synth.py or the first two languages)')
+    parser.add_argument('--database', help='database read by the steps after warc2db '
+            '(default: the one created by warc2db)')
+    parser.add_argument('--workers', type=int, default=1,
+            help='number of processes of the steps which have a --workers option')
+    parser.add_argument('--repeat', type=int, default=1,
+            help='run each step several times and keep the fastest run')
+    parser.add_argument('--json', help='write the results to this file')
+    parser.add_argument('--compare', help='results of a previous run (--json) to compare with')
+    parser.add_argument('--check', action='store_true',
+            help='only check that the article extraction gives the same results as '
+            'the reference implementation on the WARC files of the corpus')
+    parser.add_argument('--extract', nargs='+', metavar='WARC', help=argparse.SUPPRESS)
+    instrument.add_arguments(parser)
+    args = parser.parse_args()
+    instrument.start(args)
+
+    if args.extract: # step run in a child process
+        print(json.dumps(extract(args.extract)))
+        return
+    if not args.corpus:
+        parser.error('the corpus directory is required')
+    # The steps run in a temporary directory
+    args.corpus = os.path.abspath(args.corpus)
+    if args.database:
+        args.database = os.path.abspath(args.database)
+    if args.check:
+        n_records, n_diffs = check(list_warcs(args.corpus))
+        print('Records checked: {} ({} different)'.format(n_records, n_diffs))
+        sys.exit(1 if n_diffs else 0)
+
+    with open(os.path.join(args.corpus, 'synth.json')) as f:
+        manifest = json.load(f)
+    if args.pair is None:
+        aligned = manifest.get('aligned')
+        args.pair = ((aligned['src'], aligned['trg']) if aligned
+                else sorted(manifest['articles'], key=manifest['articles'].get)[::-1][:2])
+    stages = args.stages.split(',')
+    unknown = [name for name in stages if name not in stage_names]
+    if unknown:
+        parser.error('unknown steps: {}'.format(', '.join(unknown)))
+
+    warcs = list_warcs(args.corpus)
+    tmp_dir = tempfile.mkdtemp(prefix='gv-benchmark-')
+    db = args.database or os.path.join(tmp_dir, 'articles.db')
+    stats_json = os.path.join(tmp_dir, 'stats.json')
+    commands = stage_commands(args, manifest, warcs, tmp_dir, db)
+
+    results = {'commit': git_commit(), 'date': time.strftime('%Y-%m-%dT%H:%M:%S'),
+            'corpus': manifest, 'workers': args.workers, 'stages': {}}
+    try:
+        for name in stage_names:
+            if name not in stages or name not in commands:
+                continue
+            command, items = commands[name]
+            best = None
+            for _ in xrange(args.repeat):
+                if name == 'warc2db' and not args.database and os.path.exists(db):
+                    os.remove(db)
+                wall, user, system, peak_mb, output = run(command
+                        + ['--stats-json', stats_json], tmp_dir)
+                if best is None or wall < best['wall']:
+                    best = {'items': items, 'wall': wall, 'rate': items / max(wall, 1e-6),
+                            'user': user, 'sys': system, 'peak_mb': peak_mb}
+                    # Time spent in the stages measured by the step (see instrument.py)
+                    with open(stats_json) as f:
+                        best['times'] = dict((stage, measures['seconds']) for stage, measures
+                                in json.load(f)['stages'].iteritems())
+                    if name == 'extract':
+                        best['times'].update(json.loads(output)['times'])
+            results['stages'][name] = best
+            sys.stderr.write('{}: {:.2f}s\n'.format(name, best['wall']))
+    finally:
+        shutil.rmtree(tmp_dir)
+
+    previous = None
+    if args.compare:
+        with open(args.compare) as f:
+            previous = json.load(f)
+    print_results(results, previous)
+    if args.json:
+        with open(args.json, 'w') as f:
+            json.dump(results, f, indent=1, sort_keys=True)
+
+if __name__ == '__main__':
+    main()
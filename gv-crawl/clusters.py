@@ -0,0 +1,147 @@
+'''
+Translation clusters and bitext export for several language pairs at once.
+
+`build` groups the articles which are translations of each other (connected
+by translation or source links, directly or not) with a union-find over the
+whole database. `export` then writes the article pairs of every requested
+language pair in one pass over the clusters, segmenting each article once,
+in the layout written by db2bidoc.py (one directory per pair).
+'''
+import os
+import argparse
+import itertools
+import multiprocessing
+import database
+import instrument
+from db2bidoc import segment, parallel_map, BidocWriter
+
+class UnionFind(object):
+    def __init__(self):
+        self.parent = {}
+
+    def find(self, x):
+        parent = self.parent
+        parent.setdefault(x, x)
+        while parent[x] != x:
+            parent[x] = parent[parent[x]] # path halving
+            x = parent[x]
+        return x
+
+    def union(self, x, y):
+        x, y = self.find(x), self.find(y)
+        if x != y:
+            self.parent[max(x, y)] = min(x, y)
+
+    def components(self):
+        '''-> {element: component number}'''
+        roots = {}
+        return dict((x, roots.setdefault(self.find(x), len(roots)))
+                for x in sorted(self.parent))
+
+def build_clusters(conn):
+    '''Stores the translation clusters -> (number of clusters, number of articles)'''
+    cur = conn.cursor()
+    sets = UnionFind()
+    for url, link in instrument.timed_iter('query', database.translation_edges(cur)):
+        sets.union(url, link)
+    components = sets.components()
+    with instrument.stage('insert'), conn:
+        database.store_clusters(cur, components.iteritems())
+    return len(set(components.itervalues())), len(components)
+
+def parse_pairs(pairs):
+    '''"en-mg,en-sw" -> [('en', 'mg'), ('en', 'sw')]'''
+    return [tuple(pair.split('-', 1)) for pair in pairs.split(',')]
+
+def cluster_pairs(articles, pairs):
+    '''Pairs of articles of a cluster -> [(src lang, trg lang, src article, trg article)]
+
+    An article is chosen per language: the original article, or the first one.
+    Without `pairs`, all the language pairs of the cluster are used, the
+    source language being the first in alphabetical order.
+    '''
+    by_lang = {}
+    for article in articles:
+        if article.lang not in by_lang or article.url == article.source:
+            by_lang[article.lang] = article
+    if pairs is None:
+        pairs = itertools.combinations(sorted(by_lang), 2)
+    return [(src, trg, by_lang[src], by_lang[trg]) for src, trg in pairs
+            if src in by_lang and trg in by_lang]
+
+def segment_cluster(pairs):
+    '''Segments the articles of the pairs of a cluster, each one once'''
+    segmented = {}
+    for _, _, src, trg in pairs:
+        for article in (src, trg):
+            if article.url not in segmented:
+                segmented[article.url] = segment(article)
+    return pairs, segmented
+
+def export(conn, target_dir, pairs, workers=1):
+    '''Writes the article pairs of all the clusters -> {(src, trg): number of pairs}'''
+    cur = conn.cursor()
+    clusters = instrument.timed_iter('query', database.cluster_articles(cur))
+    jobs = (cluster_pairs(articles, pairs) for _, articles in clusters)
+    jobs = (job for job in jobs if job)
+    if workers > 1:
+        pool = multiprocessing.Pool(workers)
+        results = parallel_map(pool, segment_cluster, jobs)
+    else:
+        pool = None
+        results = itertools.imap(segment_cluster, jobs)
+
+    writers = {}
+    # With --workers, 'segment' is the time spent waiting for the workers
+    for found_pairs, segmented in instrument.timed_iter('segment', results):
+        instrument.count('clusters')
+        for src_lang, trg_lang, src, trg in found_pairs:
+            writer = writers.get((src_lang, trg_lang))
+            if writer is None:
+                pair_dir = os.path.join(target_dir, '{}-{}'.format(src_lang, trg_lang))
+                if not os.path.exists(pair_dir):
+                    os.makedirs(pair_dir)
+                writer = writers[src_lang, trg_lang] = BidocWriter(pair_dir)
+            writer.write(trg, src, segmented[src.url], segmented[trg.url])
+
+    if pool is not None:
+        pool.close()
+        pool.join()
+    for writer in writers.itervalues():
+        writer.close()
+    return dict((pair, writer.found) for pair, writer in writers.iteritems())
+
+def main():
+    parser = argparse.ArgumentParser(description='Build translation clusters and export '
+            'the article pairs of several language pairs')
+    subparsers = parser.add_subparsers(dest='command')
+    build_parser = subparsers.add_parser('build', help='build the translation clusters')
+    build_parser.add_argument('database', help='articles database')
+    export_parser = subparsers.add_parser('export',
+            help='write the article pairs for alignment (in TARGET_DIR/SRC-TRG)')
+    export_parser.add_argument('database', help='articles database')
+    export_parser.add_argument('target_dir', help='target directory to write articles to')
+    export_parser.add_argument('--pairs',
+            help='comma separated language pairs, e.g. en-mg,en-sw (default: all)')
+    export_parser.add_argument('--build', action='store_true',
+            help='build the translation clusters first')
+    export_parser.add_argument('--workers', type=int, default=1,
+            help='number of processes splitting articles into sentences')
+    for subparser in (build_parser, export_parser):
+        instrument.add_arguments(subparser)
+    args = parser.parse_args()
+    instrument.start(args)
+
+    conn = database.connect(args.database)
+
+    if args.command == 'build' or args.build:
+        n_clusters, n_articles = build_clusters(conn)
+        print('Translation clusters: {} ({} articles)'.format(n_clusters, n_articles))
+    if args.command == 'export':
+        pairs = parse_pairs(args.pairs) if args.pairs else None
+        found = export(conn, args.target_dir, pairs, args.workers)
+        for (src_lang, trg_lang), n in sorted(found.iteritems()):
+            print('{}-{}: {} article pairs'.format(src_lang, trg_lang, n))
+
+if __name__ == '__main__':
+    main()
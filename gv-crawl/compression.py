@@ -0,0 +1,82 @@
+'''
+Compression of article texts with a dictionary shared by all the articles.
+
+Articles are short and similar (same language, same boilerplate), so most of
+what zlib learns from one is useful for the others: deflating every text after
+a dictionary of frequent strings found in the corpus makes them much smaller
+than deflating them separately. The zlib module of Python 2 cannot set a
+dictionary, so the (de)compressors are primed by (de)compressing the
+dictionary once and are copied for every text.
+
+Compressed texts start with the number of their dictionary, so that the
+dictionary can be trained again without having to decompress old texts.
+'''
+import zlib
+from collections import defaultdict
+
+# Deflate only looks 32 kB back
+max_dictionary_size = 32768
+level = 9
+# Raw deflate streams, without header and checksum
+wbits = -15
+
+def train_dictionary(texts, size=max_dictionary_size, max_words=3):
+    '''Builds a dictionary from sample texts: the strings (word n-grams and
+    whole lines) which occur in the most texts, weighted by their length.
+    The most useful strings are at the end, where they are the cheapest to
+    refer to.'''
+    doc_freq = defaultdict(int)
+    for text in texts:
+        strings = set()
+        for line in text.split('\n'):
+            words = line.split()
+            strings.add(u' '.join(words))
+            for n in xrange(1, max_words+1):
+                for i in xrange(len(words) - n + 1):
+                    strings.add(u' '.join(words[i:i+n]))
+        for s in strings:
+            doc_freq[s] += 1
+    candidates = [(n * len(s), s.encode('utf8')) for s, n in doc_freq.iteritems()
+            if n > 1 and len(s) > 3]
+    candidates.sort(reverse=True)
+    chosen, total = [], 0
+    for _, s in candidates:
+        if total + len(s) + 1 > size:
+            if total + 5 > size:
+                break
+            continue
+        chosen.append(s)
+        total += len(s) + 1
+    return ' '.join(reversed(chosen))
+
+class Codec(object):
+    '''Compresses texts with the last of `dictionaries` ({number: dictionary})
+    and decompresses texts compressed with any of them'''
+    def __init__(self, dictionaries):
+        self.dictionary_id = max(dictionaries)
+        self.compressor = zlib.compressobj(level, zlib.DEFLATED, wbits)
+        self.compressor.compress(dictionaries[self.dictionary_id])
+        self.compressor.flush(zlib.Z_SYNC_FLUSH)
+        self.decompressors = {}
+        for number, dictionary in dictionaries.iteritems():
+            compressor = zlib.compressobj(level, zlib.DEFLATED, wbits)
+            primer = compressor.compress(dictionary) + compressor.flush(zlib.Z_SYNC_FLUSH)
+            decompressor = zlib.decompressobj(wbits)
+            decompressor.decompress(primer)
+            self.decompressors[number] = decompressor
+
+    def deflate(self, text):
+        '''unicode -> compressed buffer (None for None)'''
+        if text is None:
+            return None
+        compressor = self.compressor.copy()
+        data = compressor.compress(text.encode('utf8')) + compressor.flush()
+        return buffer(chr(self.dictionary_id) + data)
+
+    def inflate(self, data):
+        '''compressed buffer -> unicode (None for None)'''
+        if data is None:
+            return None
+        data = str(data)
+        decompressor = self.decompressors[ord(data[0])].copy()
+        return (decompressor.decompress(data[1:]) + decompressor.flush()).decode('utf8')
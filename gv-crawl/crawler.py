@@ -18,23 +18,37 @@
 A stand-alone spider for Scrapy that saves the downloaded in Warc archives.
 '''
 import os
+import re
+import hashlib
 import datetime
 import httplib
 import argparse
 import anydbm
+import whichdb
 import fileinput
-try:
-    import cStringIO as StringIO
-except ImportError:
-    import StringIO
+import urlparse
+import threading
+import Queue
+import StringIO
+import collections
+import multiprocessing
 
 import warc
 import w3lib.url
+import lxml.etree
+
+import warc_index
+from dedup import DedupIndex, open_validators, stored_validators
+from metrics import CrawlStats, StatsReporter
+import database
+import instrument
+from articles import url_pattern, process_article
 
 import scrapy.cmdline
 from scrapy.signalmanager import SignalManager
 from scrapy.item import BaseItem
 from scrapy import log, signals
+from scrapy.http import Request
 
 from scrapy.contrib.linkextractors.sgml import SgmlLinkExtractor
 from scrapy.contrib.spiders import CrawlSpider, Rule
@@ -42,21 +56,33 @@ from scrapy.contrib.spiders import CrawlSpider, Rule
 
 class WarcWriter(object):
     '''Writes `Response` objects into warc files on a given directory.'''
-    def __init__(self, outdir, max_mb_size=100, fname_prefix='scrapy'):
+    def __init__(self, outdir, max_mb_size=100, fname_prefix='scrapy', queue_size=0,
+            state_key='warc_n_start', stats=None):
         '''
         `outdir`  Output directory
         `max_mb_size`   Maximum size of the Warc files. When the current file 
                         exceeds this limit, a new file is created.
         `fname_prefix`  Prefix used to name the warc files.
+        `queue_size`    If not 0, records are compressed and written by a
+                        background thread; at most this many responses wait
+                        in its queue.
+        `state_key`     Key of the spider state where the current file
+                        number is saved.
+        `stats`         `CrawlStats` updated with the records written.
 
 
         The output directory is also used to add an index
-        file to avoid duplicated entries in the Warc files.
+        file to avoid duplicated entries in the Warc files, and
+        a byte-offset index of the records (warc-index.db).
         '''
         self.max_size = max_mb_size * 1024 * 1024
         self.outdir = outdir
         self.fname_prefix = fname_prefix
-        
+        self.queue_size = queue_size
+        self.state_key = state_key
+        self.stats = stats if stats is not None else CrawlStats()
+        self.queue = None
+
     def _get_warc_file(self):
         '''Creates a new Warc file'''
         assert self.warc_fp is None, 'Current Warc file must be None'
@@ -65,9 +91,19 @@ class WarcWriter(object):
         fname = '%s.%s.warc.gz' % (self.fname_prefix, self.file_n)
         self.warc_fname = os.path.join(self.outdir, fname)
         self.warc_fp = warc.open(self.warc_fname, 'w')
+        # Opening the file already wrote the gzip header of the first member,
+        # so tell() cannot be used for the offset of the first record
+        self.member_start = 0
+
+    def _last_file_n(self):
+        '''Returns the number of the last Warc file in the output directory'''
+        fname_re = re.compile(r'%s\.(\d+)\.warc\.gz$' % re.escape(self.fname_prefix))
+        matches = (fname_re.match(fname) for fname in os.listdir(self.outdir))
+        return max([0] + [int(m.group(1)) for m in matches if m])
 
     def open(self, spider):
-        self.file_n = spider.state.get('warc_n_start', 0)
+        # The state may be behind the files written by the background thread
+        self.file_n = max(spider.state.get(self.state_key, 0), self._last_file_n())
         log.msg('Loading state: %d' % self.file_n)
 
         # Create a new warc.gz file
@@ -75,43 +111,106 @@ class WarcWriter(object):
         self._get_warc_file()
 
         # Create the db index
-        db_fname = os.path.join(self.outdir, '.job', 'index.db')
-        self.db = anydbm.open(db_fname, 'c') # FIXED to not overwrite
+        db_fname = os.path.join(self.outdir, '.job', 'seen.db')
+        db_exists = os.path.exists(db_fname)
+        self.db = DedupIndex(db_fname)
+
+        # Import the URLs of an index created by a previous version
+        old_db_fname = os.path.join(self.outdir, '.job', 'index.db')
+        if not db_exists and whichdb.whichdb(old_db_fname):
+            old_db = anydbm.open(old_db_fname, 'r')
+            self.db.update(old_db.keys())
+            old_db.close()
+            self.db.flush()
+
+        # Create the record offset index
+        self.index = warc_index.WarcIndex(os.path.join(self.outdir, 'warc-index.db'),
+                check_same_thread=not self.queue_size)
+
+        # Start the background writer
+        if self.queue_size:
+            self.queue = Queue.Queue(self.queue_size)
+            self.thread = threading.Thread(target=self._run, name='WarcWriter')
+            self.thread.daemon = True
+            self.thread.start()
+
+    def _run(self):
+        '''Writes the queued responses until None is received'''
+        while True:
+            item = self.queue.get()
+            if item is None:
+                break
+            try:
+                self._write_response(*item)
+            except Exception:
+                log.err(_why='Cannot write Warc record: %s' % item[0])
 
     def close(self, spider):
+        if self.queue is not None:
+            self.queue.put(None)
+            self.thread.join()
+            self.queue = None
         self.db.close()
+        self.index.close()
         if not self.warc_fp is None:
             self.warc_fp.close()
 
-    def write_response(self, response):
-        '''Writes a `response` object from Scrapy as a Warc record. '''
-        # Avoid duplicated entries
-        response_url = w3lib.url.safe_download_url(response.url)
-        if response_url in self.db:
-            log.msg('Ignored already stored response: %s' % response_url, level=log.DEBUG)
-            return
-        self.db[response_url] = '1'
+    def save_state(self, state):
+        state[self.state_key] = self.file_n
 
-        # Create the payload string
-        payload = StringIO.StringIO()
-        status_reason = httplib.responses.get(response.status, '-')
-        payload.write('HTTP/1.1 %d %s\r\n' % (response.status, status_reason))
-        for h_name in response.headers:
-            payload.write('%s: %s\n' % (h_name, response.headers[h_name]))
+    def queue_depth(self):
+        '''Number of responses waiting for the background writer'''
+        return self.queue.qsize() if self.queue is not None else 0
 
-        payload.write('\r\n')
-        payload.write(response.body)
+    def validators(self, url):
+        '''Returns (ETag, Last-Modified, body digest) stored for `url`, or None'''
+        if getattr(self, 'db', None) is None: # not opened yet
+            return None
+        return self.db.validators(w3lib.url.safe_download_url(url))
 
+    def write_response(self, response):
+        '''Writes a `response` object from Scrapy as a Warc record.
+
+        Returns False if the same content was already stored for this URL.
+        '''
+        # Avoid duplicated entries; pages whose content changed are stored again
+        response_url = w3lib.url.safe_download_url(response.url)
+        digest = hashlib.sha1(response.body).hexdigest()
+        validators = self.db.validators(response_url)
+        self.db.set_validators(response_url, response.headers.get('ETag'),
+                response.headers.get('Last-Modified'), digest)
+        if response_url in self.db:
+            if validators is None or validators[2] == digest:
+                log.msg('Ignored already stored response: %s' % response_url, level=log.DEBUG)
+                self.stats.inc('dedup_hits')
+                return False
+            log.msg('Storing modified response: %s' % response_url, level=log.DEBUG)
+        else:
+            self.db.add(response_url)
+
+        # Build the HTTP headers here; the body is not copied until the record is built
+        item = (response_url, WarcWriter.http_headers(response), response.body,
+                str(response.headers.get('Content-Type', '')), WarcWriter.now_iso_format())
+        self.stats.inc('records')
+        self.stats.inc('bytes_written_raw', len(item[1]) + len(item[2]))
+        if self.queue is not None:
+            self.queue.put(item)
+        else:
+            self._write_response(*item)
+        return True
+
+    def _write_response(self, response_url, http_headers, body, content_type, date):
+        '''Builds the Warc record of a response and writes it'''
         headers = {
             'WARC-Type': 'response',
-            'WARC-Date': WarcWriter.now_iso_format(),
-            'Content-Length': str(payload.tell()),
-            'Content-Type': str(response.headers.get('Content-Type', '')),
+            'WARC-Date': date,
+            'Content-Length': str(len(http_headers) + len(body)),
+            'Content-Type': content_type,
 
             # Optional headers
             'WARC-Target-URI': response_url
         }
-        record = warc.WARCRecord(payload=payload.getvalue(), headers=headers)
+        record = warc.WARCRecord(payload=http_headers + body, headers=headers)
 
         self._write_record(record)
 
@@ -121,14 +220,30 @@ class WarcWriter(object):
         If the current file exceeds the limit defined by `self.max_size`, the
         file is closed and a new one is created.
         '''
+        offset = self.member_start
         self.warc_fp.write_record(record)
 
-        curr_pos = self.warc_fp.tell()
+        # The member of the record is closed: this is where the next one starts
+        curr_pos = self.member_start = self.warc_fp.tell()
+        self.index.add(record['WARC-Target-URI'], self.warc_fname,
+                offset, curr_pos - offset, record['WARC-Date'])
+        self.stats.inc('bytes_written_compressed', curr_pos - offset)
         if curr_pos > self.max_size:
+            self.stats.inc('warc_rotations')
             self.warc_fp.close()
             self.warc_fp = None
             self._get_warc_file()
 
+    @staticmethod
+    def http_headers(response):
+        '''Returns the status line and headers of a response, as stored in the records'''
+        status_reason = httplib.responses.get(response.status, '-')
+        http_headers = ['HTTP/1.1 %d %s\r\n' % (response.status, status_reason)]
+        for h_name in response.headers:
+            http_headers.append('%s: %s\n' % (h_name, response.headers[h_name]))
+        http_headers.append('\r\n')
+        return ''.join(http_headers)
+
     @staticmethod
     def now_iso_format():
         '''Returns a string with the current time according to the ISO8601 format'''
@@ -136,23 +251,203 @@ class WarcWriter(object):
         return now.strftime("%Y-%m-%dT%H:%M:%SZ")
 
 
+# Monthly archive pages (and their pagination), which list articles
+archive_pattern = r'/\d{4}/\d{2}/(page/\d+/)?$'
+archive_re = re.compile(archive_pattern)
+
+
+class HostWarcWriter(object):
+    '''Routes responses to a `WarcWriter` per host.
+
+    The records of each host are written in their own Warc series, with their
+    own indexes, in the `outdir`/`host` directory.
+    '''
+    def __init__(self, outdir, **kwargs):
+        self.outdir = outdir
+        self.kwargs = kwargs
+        self.writers = {}
+        # {host: connection to the seen index of a previous crawl, or None},
+        # for the hosts which have no writer yet
+        self.indexes = {}
+        self.spider = None
+
+    def open(self, spider):
+        self.spider = spider
+
+    def close(self, spider):
+        for writer in self.writers.itervalues():
+            writer.close(spider)
+        for conn in self.indexes.itervalues():
+            if conn is not None:
+                conn.close()
+        self.indexes = {}
+
+    def _writer(self, url):
+        host = urlparse.urlparse(url).hostname
+        writer = self.writers.get(host)
+        if writer is None:
+            conn = self.indexes.pop(host, None)
+            if conn is not None:
+                conn.close()
+            host_dir = os.path.join(self.outdir, host)
+            if not os.path.exists(os.path.join(host_dir, '.job')):
+                os.makedirs(os.path.join(host_dir, '.job'))
+            writer = WarcWriter(host_dir, state_key='warc_n_start:'+host, **self.kwargs)
+            writer.open(self.spider)
+            self.writers[host] = writer
+        return writer
+
+    def save_state(self, state):
+        for writer in self.writers.itervalues():
+            writer.save_state(state)
+
+    def queue_depth(self):
+        return sum(writer.queue_depth() for writer in self.writers.itervalues())
+
+    def validators(self, url):
+        if self.spider is None: # not opened yet
+            return None
+        host = urlparse.urlparse(url).hostname
+        writer = self.writers.get(host)
+        if writer is not None:
+            return writer.validators(url)
+        # Read the index of a previous crawl: no writer (and no files) is
+        # created for a lookup, e.g. for offsite requests
+        if not host:
+            return None
+        if host not in self.indexes:
+            self.indexes[host] = open_validators(
+                    os.path.join(self.outdir, host, '.job', 'seen.db'))
+        if self.indexes[host] is None:
+            return None
+        return stored_validators(self.indexes[host], w3lib.url.safe_download_url(url))
+
+    def write_response(self, response):
+        return self._writer(response.url).write_response(response)
+
+
+# Stands for a Warc record in `process_article`
+Record = collections.namedtuple('Record', 'url payload')
+
+def extract_article(job):
+    '''Extracts the article of a downloaded page -> (article, error)'''
+    url, payload = job
+    try:
+        return process_article(Record(url, StringIO.StringIO(payload))), None
+    except AssertionError as e:
+        return None, '%s\t%s' % (url, e)
+    except Exception as e:
+        return None, '%s\t%s: %s' % (url, e.__class__.__name__, e)
+
+
+class ArticleExtractor(object):
+    '''Extracts the articles of the archived pages in a pool of processes and
+    inserts them into an articles database, as `warc2db.py` does.
+
+    `path`        Articles database
+    `workers`     Number of extraction processes
+    `batch_size`  Number of articles inserted per transaction
+    `stats`       `CrawlStats` updated with the number of extracted articles
+    '''
+    def __init__(self, path, workers=1, batch_size=100, stats=None):
+        self.path = path
+        self.batch_size = batch_size
+        self.stats = stats if stats is not None else CrawlStats()
+        self.articles = []
+        # (url, result) of the extractions, in the order they were queued
+        self.pending = collections.deque()
+        # Fork before the reactor starts its threads
+        self.pool = multiprocessing.Pool(workers)
+
+    def open(self, spider):
+        self.conn = database.connect(self.path)
+
+    def close(self, spider):
+        self.pool.close()
+        self.pool.join()
+        self._collect()
+        self._insert()
+        self.conn.close()
+
+    def process_response(self, response):
+        '''Queues the extraction of the article of an archived page'''
+        url = w3lib.url.safe_download_url(response.url)
+        if not url_pattern.match(url):
+            return
+        payload = WarcWriter.http_headers(response) + response.body
+        self.pending.append((url, self.pool.apply_async(extract_article, ((url, payload),))))
+        self._collect()
+
+    def _collect(self):
+        while self.pending and self.pending[0][1].ready():
+            url, result = self.pending.popleft()
+            try:
+                article, error = result.get()
+            except Exception as e: # failed in the pool, e.g. the result cannot be pickled
+                article, error = None, '%s\t%s: %s' % (url, e.__class__.__name__, e)
+            if error is not None:
+                self.stats.inc('extraction_errors')
+                log.msg('Cannot extract article: %s' % error, level=log.WARNING)
+                continue
+            self.stats.inc('articles')
+            self.articles.append(article)
+        if len(self.articles) >= self.batch_size:
+            self._insert()
+
+    def _insert(self):
+        if not self.articles:
+            return
+        with self.conn:
+            database.upsert_articles(self.conn.cursor(), self.articles)
+        self.articles = []
+
+
 class WarcSpider(CrawlSpider):
-    '''Stand-alone spider that stores pages in a WARC file'''
+    '''Stand-alone spider that stores pages in a WARC file
+
+    Articles are reached from the seeds by following the previous/next article
+    links, and from monthly archive pages, RSS feeds and sitemaps used as seeds,
+    so that many independent segments of the website are crawled concurrently.
+
+    Requests for pages which were already stored are conditional (using the
+    ETag and Last-Modified headers of the previous response), and links are
+    not followed from pages which did not change since they were stored.
+    '''
     name = 'warc'
     start_urls = []
     allowed_domains = []
+    handle_httpstatus_list = [304]
 
-    def __init__(self, seeds=None, outdir=None, domains=None):
+    def __init__(self, seeds=None, outdir=None, domains=None, write_queue=0, per_host=0,
+            stats_file=None, stats_port=0, stats_interval=10, database=None,
+            extract_workers=1):
         '''
         `seeds`       Text file containing the seed URLs. One URL per line.
         `outdir`      Output directory
         `domains`     Comma separated list of allowed domains.
+        `write_queue` Size of the queue of the background Warc writer
+                      (0 to write records in the crawling thread).
+        `per_host`    If not 0, write the pages of each host in its own
+                      subdirectory of `outdir`.
+        `stats_file`  JSON file where the crawl statistics are written
+                      every `stats_interval` seconds.
+        `stats_port`  If not 0, serve the statistics in the Prometheus
+                      format on http://127.0.0.1:`stats_port`/metrics
+        `database`    If given, articles are extracted from the archived
+                      pages by `extract_workers` processes and inserted
+                      into this database.
         '''
 
         # FIXED this way no need to compile after init
-        WarcSpider.rules = [Rule(SgmlLinkExtractor(allow=r'.*', tags='link',
+        WarcSpider.rules = [Rule(SgmlLinkExtractor(allow=r'.*', deny=archive_pattern, tags='link',
             restrict_xpaths=('//link[@rel="prev"]', '//link[@rel="next"]')),
-            callback='archive_page', follow=True)]
+            callback='archive_page', follow=True, process_request='conditional_request'),
+            # Pagination of the archives
+            Rule(SgmlLinkExtractor(allow=archive_pattern), follow=True),
+            # Articles listed in the archives
+            Rule(SgmlLinkExtractor(restrict_xpaths=
+                '//h2[contains(concat(" ", normalize-space(@class), " "), " post-title ")]'),
+                callback='archive_page', follow=True, process_request='conditional_request')]
 
         super(WarcSpider, self).__init__()
 
@@ -165,7 +460,19 @@ class WarcSpider(CrawlSpider):
         # FIXME: Validate settings
         #assert settings['DOWNLOAD_DELAY'] > 0, 'download_delay must be greater than 0'
 
-        self.writer = WarcWriter(outdir)
+        self.stats = CrawlStats()
+        self.reporter = StatsReporter(self.stats, stats_file, int(stats_port),
+                float(stats_interval))
+        if int(per_host):
+            self.writer = HostWarcWriter(outdir, queue_size=int(write_queue), stats=self.stats)
+        else:
+            self.writer = WarcWriter(outdir, queue_size=int(write_queue), stats=self.stats)
+        self.extractor = None
+        if database:
+            self.extractor = ArticleExtractor(database, int(extract_workers), stats=self.stats)
+
+        # URLs of the conditional requests made in this run
+        self.requested = set()
 
         # Load the seeds
         WarcSpider.start_urls = WarcSpider.load_seeds(seeds)
@@ -176,18 +483,97 @@ class WarcSpider(CrawlSpider):
         # Configure signals
         crawler.signals.connect(self.writer.open, signals.spider_opened)
         crawler.signals.connect(self.writer.close, signals.spider_closed)
+        if self.extractor is not None:
+            crawler.signals.connect(self.extractor.open, signals.spider_opened)
+            crawler.signals.connect(self.extractor.close, signals.spider_closed)
+        crawler.signals.connect(self.response_received, signals.response_received)
+        crawler.signals.connect(self.open_stats, signals.spider_opened)
+        crawler.signals.connect(self.close_stats, signals.spider_closed)
+
+    def open_stats(self, spider):
+        engine = self.crawler.engine
+        self.stats.gauge('scheduler_queue', lambda: len(engine.slots[spider].scheduler))
+        self.stats.gauge('downloader_active', lambda: len(engine.downloader.active))
+        self.stats.gauge('write_queue', self.writer.queue_depth)
+        self.reporter.start()
+
+    def close_stats(self, spider):
+        self.reporter.stop()
+
+    def response_received(self, response, request, spider):
+        '''Counts the downloaded pages and their latency per host'''
+        self.stats.inc('pages')
+        self.stats.inc('bytes_downloaded', len(response.body))
+        if response.status == 304:
+            self.stats.inc('not_modified')
+        latency = response.meta.get('download_latency')
+        if latency is not None:
+            self.stats.observe_latency(urlparse.urlparse(response.url).hostname, latency)
+
+    def conditional_request(self, request):
+        '''Adds validators to the request of a page which was already stored
+
+        The persistent duplicate filter would drop the requests of the pages
+        crawled in a previous run: the first request of such a page in this
+        run bypasses it.
+        '''
+        first = request.url not in self.requested
+        self.requested.add(request.url)
+        validators = self.writer.validators(request.url)
+        if validators is None:
+            return request
+        if first and not request.dont_filter:
+            request = request.replace(dont_filter=True)
+        etag, last_modified, _ = validators
+        if etag:
+            request.headers.setdefault('If-None-Match', etag)
+        if last_modified:
+            request.headers.setdefault('If-Modified-Since', last_modified)
+        return request
+
+    def make_requests_from_url(self, url):
+        return self.conditional_request(super(WarcSpider, self).make_requests_from_url(url))
 
     def archive_page(self, response):
         '''Callback function that stores a response as a WARC record.'''
-        self.writer.write_response(response)
+        if response.status == 304:
+            log.msg('Not modified: %s' % response.url, level=log.DEBUG)
+            response.meta['archived'] = False
+            return
+        response.meta['archived'] = self.writer.write_response(response)
         log.msg('Response added to Warc: %s' % response.url, level=log.DEBUG)
-        self.state['warc_n_start'] = self.writer.file_n
+        if self.extractor is not None and response.meta['archived']:
+            self.extractor.process_response(response)
+        self.writer.save_state(self.state)
+
+    def _requests_to_follow(self, response):
+        # Stop walking the prev/next chain in an already archived region
+        if not response.meta.get('archived', True):
+            return []
+        return super(WarcSpider, self)._requests_to_follow(response)
 
     # FIXED avoid duplicate archive and overrinding _parse_response
     def parse_start_url(self, response):
-        '''Initial callback function for seeds'''
+        '''Initial callback function for seeds
+
+        Feeds and sitemaps are expanded into requests and archive pages are
+        only used to follow links; other pages are stored.
+        '''
+        if 'xml' in response.headers.get('Content-Type', ''):
+            return self.parse_feed(response)
+        if archive_re.search(response.url):
+            return []
         self.archive_page(response)
 
+    def parse_feed(self, response):
+        '''Requests the pages listed in an RSS feed or a (nested) sitemap'''
+        parser = lxml.etree.XMLParser(recover=True)
+        feed = lxml.etree.fromstring(response.body, parser)
+        if feed is None:
+            return []
+        urls = feed.xpath('//*[local-name()="loc"]/text() | //item/link/text()')
+        return [self.conditional_request(Request(url.strip())) for url in urls]
+
     @staticmethod
     def load_seeds(fname):
         '''Loads the seeds from a text file.
@@ -206,22 +592,42 @@ class WarcSpider(CrawlSpider):
 
 def main():
     parser = argparse.ArgumentParser()
-    parser.add_argument('--delay',  type=int, default=1)
+    parser.add_argument('--delay',  type=float, default=1)
+    parser.add_argument('--concurrency', type=int, default=8,
+            help='maximum number of concurrent requests per host')
     parser.add_argument('--depth', type=int, default=0)
     parser.add_argument('--domains', '-d')
     parser.add_argument('--user_agent')
     parser.add_argument('--silent', action='store_true', default=False)
     parser.add_argument('--loglevel', choices=('CRITICAL', 'ERROR', 'WARNING', 'INFO', 'DEBUG'))
+    parser.add_argument('--per-host', action='store_true',
+            help='write the pages of each host (e.g. language edition) in its own subdirectory')
+    parser.add_argument('--write-queue', type=int, default=0,
+            help='compress and write records in a background thread with a queue of this size')
+    parser.add_argument('--database',
+            help='extract the articles while crawling and insert them into this database')
+    parser.add_argument('--extract-workers', type=int, default=1,
+            help='number of processes extracting articles with --database')
+    parser.add_argument('--stats-file',
+            help='write crawl statistics (pages/s, bytes, latency per host...) to this JSON file')
+    parser.add_argument('--stats-port', type=int, default=0,
+            help='serve crawl statistics in the Prometheus format on this local port')
+    parser.add_argument('--stats-interval', type=float, default=10,
+            help='number of seconds between two writes of the statistics file')
 
     parser.add_argument('seeds')
     parser.add_argument('outdir')
+    instrument.add_arguments(parser)
 
     args = parser.parse_args()
+    instrument.start(args)
 
     # FIXED added job dir for state persistence
     jobdir = os.path.join(args.outdir, '.job')
     argv = ('scrapy runspider -s AUTOTHROTTLE_ENABLED=1 '
-    '-s DEPTH_LIMIT={} -s DOWNLOAD_DELAY={} -s JOBDIR={}').format(args.depth, args.delay, jobdir)
+    '-s DEPTH_LIMIT={} -s DOWNLOAD_DELAY={} -s JOBDIR={} '
+    '-s CONCURRENT_REQUESTS_PER_DOMAIN={}').format(args.depth, args.delay, jobdir,
+            args.concurrency)
     argv = argv.split(' ')
     if args.user_agent:
         argv.extend(['-s', 'USER_AGENT="%s"' % args.user_agent])
@@ -237,6 +643,21 @@ def main():
     argv.extend(['-a', 'seeds=%s' % args.seeds])
     if args.domains:
         argv.extend(['-a', 'domains=%s' % args.domains])
+    if args.per_host:
+        # Let every host use its share of concurrent requests
+        hosts = set(urlparse.urlparse(url).hostname for url in WarcSpider.load_seeds(args.seeds))
+        argv.extend(['-s', 'CONCURRENT_REQUESTS=%d' % max(16, args.concurrency * len(hosts))])
+        argv.extend(['-a', 'per_host=1'])
+    if args.write_queue:
+        argv.extend(['-a', 'write_queue=%d' % args.write_queue])
+    if args.database:
+        argv.extend(['-a', 'database=%s' % args.database])
+        argv.extend(['-a', 'extract_workers=%d' % args.extract_workers])
+    if args.stats_file:
+        argv.extend(['-a', 'stats_file=%s' % args.stats_file])
+        argv.extend(['-a', 'stats_interval=%s' % args.stats_interval])
+    if args.stats_port:
+        argv.extend(['-a', 'stats_port=%d' % args.stats_port])
 
     scrapy.cmdline.execute(argv=argv)
 
@@ -0,0 +1,484 @@
+import re
+import sqlite3
+import fingerprint
+import compression
+from articles import Article, url_pattern, article_date
+
+articles_table = """create table if not exists articles(url text primary key,
+                                             id int,
+                                             lang char(3),
+                                             metadata text,
+                                             translations text,
+                                             source text,
+                                             title text,
+                                             entry text)"""
+
+# Columns added to the articles table after its creation
+added_columns = [('year', 'int'), ('month', 'int'), ('day', 'int'),
+                 ('content_hash', 'text'), ('simhash', 'int')]
+
+# Indexes and triggers of the articles table (article_meta in compressed databases)
+article_schema = ['create index if not exists articles_id on {}(id)',
+          'create index if not exists articles_lang on {}(lang)',
+          'create index if not exists articles_date on {}(lang, year, month, day)',
+          'create index if not exists articles_content on {}(lang, content_hash)',
+          # An upsert: the statements of a trigger use the conflict resolution of
+          # the statement firing it, so insert or ignore would replace the row
+          """create trigger if not exists article_counts_insert after insert on {}
+             when new.year is not null begin
+                 insert into article_counts(lang, year, month, n)
+                     values (new.lang, new.year, new.month, 1)
+                     on conflict(lang, year, month) do update set n = n + 1;
+             end""",
+          """create trigger if not exists article_counts_delete after delete on {}
+             when old.year is not null begin
+                 update article_counts set n = n - 1
+                     where lang = old.lang and year = old.year and month = old.month;
+             end"""]
+
+schema = [# URLs of the articles found to be duplicates of another one
+          """create table if not exists aliases(url text primary key,
+                                             canonical text,
+                                             reason text)""",
+          'create index if not exists aliases_canonical on aliases(canonical)',
+          # Bands of the SimHash fingerprints, to find near-duplicates
+          """create table if not exists simhash_bands(url text,
+                                             lang char(3),
+                                             band int,
+                                             value int)""",
+          'create index if not exists simhash_bands_value on simhash_bands(lang, band, value)',
+          'create index if not exists simhash_bands_url on simhash_bands(url)',
+          # Translation clusters: connected components of the translation and
+          # source links, built by clusters.py
+          """create table if not exists clusters(url text primary key,
+                                             cluster int)""",
+          'create index if not exists clusters_cluster on clusters(cluster)',
+          # Article pairs written to each directory by db2bidoc.py --incremental
+          """create table if not exists exports(target text,
+                                             trg_id int,
+                                             src_url text,
+                                             hash text,
+                                             primary key (target, trg_id))""",
+          # WARC files already loaded and the byte offset reached in each one
+          """create table if not exists warcs(path text primary key,
+                                             size int,
+                                             mtime real,
+                                             offset int)""",
+          # First translation link of each article for every language
+          """create table if not exists links(url text,
+                                             lang char(3),
+                                             post_id int,
+                                             link text,
+                                             primary key (url, lang))""",
+          # Number of articles per month, kept up to date by triggers
+          """create table if not exists article_counts(lang char(3),
+                                             year int,
+                                             month int,
+                                             n int,
+                                             primary key (lang, year, month))"""]
+
+article_columns = ', '.join(Article._fields)
+
+upsert_columns = Article._fields + tuple(name for name, _ in added_columns)
+upsert_statement = ('insert or replace into articles('+', '.join(upsert_columns)
+        +') values ('+', '.join(['?']*len(upsert_columns))+')')
+
+# Compressed databases (see compress_articles) store the metadata columns in
+# article_meta and the title and compressed entry in article_body (same rowid).
+# The articles view joins them, and its triggers write to both tables.
+body_columns = ('title', 'entry')
+meta_columns = tuple(name for name in upsert_columns if name not in body_columns)
+
+article_meta_table = """create table if not exists article_meta(url text primary key,
+                                             id int,
+                                             lang char(3),
+                                             metadata text,
+                                             translations text,
+                                             source text)"""
+
+compressed_schema = ["""create table if not exists article_body(article integer primary key,
+                                             title text,
+                                             entry blob)""",
+          # Zlib dictionaries, numbered as in the compressed entries
+          """create table if not exists compression_dicts(id integer primary key,
+                                             dictionary blob)""",
+          ('create view if not exists articles as select m.rowid as rowid, {}'
+           ' from article_meta m left join article_body b on b.article = m.rowid').format(
+              ', '.join('inflate(b.entry) as entry' if name == 'entry'
+                  else ('b.' if name in body_columns else 'm.')+name for name in upsert_columns)),
+          """create trigger if not exists articles_insert instead of insert on articles begin
+                 delete from article_meta where url = new.url;
+                 insert into article_meta({}) values ({});
+                 insert into article_body(article, title, entry)
+                     values ((select rowid from article_meta where url = new.url),
+                             new.title, deflate(new.entry));
+             end""".format(', '.join(meta_columns),
+                 ', '.join('new.'+name for name in meta_columns)),
+          """create trigger if not exists articles_update instead of update on articles begin
+                 update article_meta set {} where rowid = old.rowid;
+             end""".format(', '.join('{0} = new.{0}'.format(name) for name in meta_columns)),
+          """create trigger if not exists articles_update_body
+             instead of update of title, entry on articles begin
+                 update article_body set title = new.title, entry = deflate(new.entry)
+                     where article = old.rowid;
+             end""",
+          """create trigger if not exists articles_delete instead of delete on articles begin
+                 delete from article_meta where rowid = old.rowid;
+             end""",
+          """create trigger if not exists article_meta_delete after delete on article_meta begin
+                 delete from article_body where article = old.rowid;
+             end"""]
+
+# Full-text index of the titles and entries (created by db_search.py), kept up
+# to date by triggers on the table storing them
+search_table = ("create virtual table if not exists article_search using fts5(title, entry,"
+        " content='articles', content_rowid='rowid')")
+search_triggers = ["""create trigger if not exists article_search_insert after insert on {table}
+             begin
+                 insert into article_search(rowid, title, entry)
+                     values (new.{rowid}, new.title, {entry}(new.entry));
+             end""",
+          """create trigger if not exists article_search_delete after delete on {table}
+             begin
+                 insert into article_search(article_search, rowid, title, entry)
+                     values ('delete', old.{rowid}, old.title, {entry}(old.entry));
+             end""",
+          """create trigger if not exists article_search_update
+             after update of title, entry on {table}
+             when old.title is not new.title or {entry}(old.entry) is not {entry}(new.entry) begin
+                 insert into article_search(article_search, rowid, title, entry)
+                     values ('delete', old.{rowid}, old.title, {entry}(old.entry));
+                 insert into article_search(rowid, title, entry)
+                     values (new.{rowid}, new.title, {entry}(new.entry));
+             end"""]
+# {compressed: trigger parameters}
+search_tables = {False: {'table': 'articles', 'rowid': 'rowid', 'entry': ''},
+                 True: {'table': 'article_body', 'rowid': 'article', 'entry': 'inflate'}}
+
+id_pattern = re.compile('.*\?p=(\d+)$')
+
+def link_lang(url):
+    """Language of a Global Voices URL (None for other websites)"""
+    m = url_pattern.match(url)
+    if not m: return None
+    l = m.group(1)
+    l = 'en' if not l else l[:-1]
+    return 'en' if l in ('rising', 'advocacy') else l
+
+def translation_links(article):
+    """Parse the translations of an article -> [(url, lang, post id, link)]"""
+    links = {}
+    for link in article.translations.split():
+        lang = link_lang(link)
+        if lang is None or lang in links: continue
+        m = id_pattern.match(link)
+        links[lang] = (article.url, lang, (int(m.group(1)) if m else None), link)
+    return links.values()
+
+def _build_links(conn):
+    cur = conn.cursor()
+    cur.execute('select url, translations from articles')
+    for rows in iter(lambda: cur.fetchmany(1000), []):
+        for url, translations in rows:
+            conn.executemany('insert or replace into links(url, lang, post_id, link)'
+                    ' values (?, ?, ?, ?)', translation_links(Article(url, None, None,
+                        None, translations, None, None, None)))
+
+def _add_dates(conn):
+    rows = conn.execute('select rowid, metadata from articles').fetchall()
+    conn.executemany('update articles set year = ?, month = ?, day = ? where rowid = ?',
+            ((article_date(metadata) or (None, None, None)) + (rowid,)
+                for rowid, metadata in rows))
+    _count_articles(conn)
+
+def _count_articles(conn):
+    conn.execute('delete from article_counts')
+    conn.execute('insert into article_counts(lang, year, month, n)'
+            ' select lang, year, month, count(*) from articles'
+            ' where year is not null group by lang, year, month')
+
+def _fix_counts_trigger(conn):
+    table = 'article_meta' if _table_exists(conn, 'article_meta') else 'articles'
+    conn.execute('drop trigger article_counts_insert')
+    for statement in article_schema:
+        conn.execute(statement.format(table))
+    _count_articles(conn)
+
+def _add_fingerprints(conn):
+    rows = conn.execute('select rowid, url, lang, entry from articles').fetchall()
+    for rowid, url, lang, entry in rows:
+        content_hash, simhash = fingerprint.fingerprint(entry)
+        conn.execute('update articles set content_hash = ?, simhash = ? where rowid = ?',
+                (content_hash, fingerprint.to_signed(simhash), rowid))
+        _add_bands(conn, url, lang, simhash)
+
+# Fill the tables and columns added to existing databases;
+# the index is PRAGMA user_version
+migrations = [_build_links, _add_dates, _add_fingerprints, _fix_counts_trigger]
+
+def _table_exists(conn, name):
+    return conn.execute('select 1 from sqlite_master where name = ?', (name,)).fetchone() is not None
+
+def _set_codec(conn):
+    """Register the inflate and deflate functions of a compressed database"""
+    codec = compression.Codec(dict((number, str(dictionary)) for number, dictionary
+        in conn.execute('select id, dictionary from compression_dicts')))
+    conn.create_function('deflate', 1, codec.deflate)
+    conn.create_function('inflate', 1, codec.inflate)
+
+def _create_schema(conn, compressed):
+    table = 'article_meta' if compressed else 'articles'
+    conn.execute(article_meta_table if compressed else articles_table)
+    columns = set(row[1] for row in conn.execute('pragma table_info({})'.format(table)))
+    for name, column_type in added_columns:
+        if name not in columns:
+            conn.execute('alter table {} add column {} {}'.format(table, name, column_type))
+            if compressed: # created again with the new column
+                conn.execute('drop view if exists articles')
+    for statement in schema:
+        conn.execute(statement)
+    for statement in compressed_schema if compressed else []:
+        conn.execute(statement)
+    for statement in article_schema:
+        conn.execute(statement.format(table))
+    if _table_exists(conn, 'article_search'):
+        for statement in search_triggers:
+            conn.execute(statement.format(**search_tables[compressed]))
+
+def connect(path):
+    """Open the articles database, creating missing tables"""
+    conn = sqlite3.connect(path)
+    # Needed for replaced rows to fire the delete triggers
+    conn.execute('pragma recursive_triggers = on')
+    compressed = _table_exists(conn, 'article_meta')
+    if compressed:
+        _set_codec(conn)
+    with conn:
+        _create_schema(conn, compressed)
+        version = conn.execute('pragma user_version').fetchone()[0]
+        for migration in migrations[version:]:
+            migration(conn)
+        conn.execute('pragma user_version = {}'.format(len(migrations)))
+    return conn
+
+def _add_bands(cur, url, lang, simhash):
+    if simhash is not None:
+        cur.executemany('insert into simhash_bands(url, lang, band, value) values (?, ?, ?, ?)',
+                ((url, lang, band, value) for band, value in enumerate(fingerprint.bands(simhash))))
+
+def _delete_article(cur, url):
+    for table in ('articles', 'links', 'simhash_bands'):
+        cur.execute('delete from {} where url = ?'.format(table), (url,))
+
+def find_duplicate(cur, article, content_hash, simhash):
+    """Find a stored article which is the same post as `article`: same language and
+    post ID, same text or near-identical text -> (url, reason) or None"""
+    cur.execute('select url from articles where lang = ? and id = ? and url != ?',
+            (article.lang, article.id, article.url))
+    row = cur.fetchone()
+    if row is not None:
+        return row[0], 'id'
+    if simhash is None:
+        return None
+    cur.execute('select url from articles where lang = ? and content_hash = ? and url != ?',
+            (article.lang, content_hash, article.url))
+    row = cur.fetchone()
+    if row is not None:
+        return row[0], 'content'
+    for band, value in enumerate(fingerprint.bands(simhash)):
+        cur.execute('select a.url, a.simhash from simhash_bands b join articles a on a.url = b.url'
+                ' where b.lang = ? and b.band = ? and b.value = ? and b.url != ?',
+                (article.lang, band, value, article.url))
+        for url, other in cur.fetchall():
+            if fingerprint.distance(simhash, fingerprint.from_signed(other)) <= fingerprint.max_distance:
+                return url, 'simhash'
+    return None
+
+def _add_alias(cur, url, canonical, reason):
+    cur.execute('insert or replace into aliases(url, canonical, reason) values (?, ?, ?)',
+            (url, canonical, reason))
+
+def _insert_article(cur, article, content_hash, simhash):
+    cur.execute(upsert_statement, tuple(article) + (article_date(article.metadata)
+        or (None, None, None)) + (content_hash, fingerprint.to_signed(simhash)))
+    cur.execute('delete from links where url = ?', (article.url,))
+    cur.executemany('insert into links(url, lang, post_id, link) values (?, ?, ?, ?)',
+            translation_links(article))
+    cur.execute('delete from simhash_bands where url = ?', (article.url,))
+    _add_bands(cur, article.url, article.lang, simhash)
+
+def upsert_articles(cur, articles, dedup=False):
+    """Insert or replace articles -> number of articles stored as aliases.
+    With `dedup`, an article which is the same post as a stored one (see
+    find_duplicate) is recorded as an alias of it instead; an article
+    under its full URL replaces the same post stored under its ?p=<id> URL."""
+    n_aliases = 0
+    for article in articles:
+        content_hash, simhash = fingerprint.fingerprint(article.entry)
+        duplicate = find_duplicate(cur, article, content_hash, simhash) if dedup else None
+        if duplicate is not None:
+            canonical, reason = duplicate
+            n_aliases += 1
+            if not (id_pattern.match(canonical) and not id_pattern.match(article.url)):
+                _add_alias(cur, article.url, canonical, reason)
+                continue
+            # Keep the full URL as canonical
+            _delete_article(cur, canonical)
+            cur.execute('update aliases set canonical = ? where canonical = ?',
+                    (article.url, canonical))
+            _add_alias(cur, canonical, article.url, reason)
+        cur.execute('delete from aliases where url = ?', (article.url,))
+        _insert_article(cur, article, content_hash, simhash)
+    return n_aliases
+
+def article_pairs(cur, trg_lang, src_lang):
+    """Iterate over (target article, source article) for all the target language
+    articles which have a translation in the source language.
+    Links to ?p=<id> URLs prefer an article in the source language and links
+    to duplicates lead to their canonical article."""
+    trg_columns = ', '.join('t.'+c for c in Article._fields)
+    src_columns = ', '.join('s.'+c for c in Article._fields)
+    cur.execute(('select {0}, {1}, 0 from articles t'
+        ' join links l on l.url = t.url and l.lang = :src'
+        ' left join aliases a on a.url = l.link'
+        ' join articles s on s.url = coalesce(a.canonical, l.link)'
+        ' where t.lang = :trg and l.post_id is null'
+        ' union all'
+        ' select {0}, {1}, min(s.lang != :src) from articles t'
+        ' join links l on l.url = t.url and l.lang = :src'
+        ' join articles s on s.id = l.post_id'
+        ' where t.lang = :trg and l.post_id is not null'
+        ' group by t.url').format(trg_columns, src_columns),
+        {'src': src_lang, 'trg': trg_lang})
+    n = len(Article._fields)
+    for rows in iter(lambda: cur.fetchmany(1000), []):
+        for row in rows:
+            yield Article(*row[:n]), Article(*row[n:2*n])
+
+def warc_progress(cur, path):
+    """Return (size, mtime, offset) recorded for a WARC file, or None"""
+    cur.execute('select size, mtime, offset from warcs where path = ?', (path,))
+    return cur.fetchone()
+
+def set_warc_progress(cur, path, size, mtime, offset):
+    cur.execute('insert or replace into warcs(path, size, mtime, offset) values (?, ?, ?, ?)',
+            (path, size, mtime, offset))
+
+def count_mismatches(cur):
+    """Check the monthly counts against the articles -> [(lang, number of
+    dated articles, sum of the counts)] for the languages where they differ"""
+    cur.execute('select a.lang, a.n, coalesce(c.n, 0) from'
+            ' (select lang, count(*) as n from articles where year is not null'
+            '  group by lang) a'
+            ' left join (select lang, sum(n) as n from article_counts group by lang) c'
+            ' on c.lang = a.lang where a.n != coalesce(c.n, 0)')
+    return cur.fetchall()
+
+def exported_pairs(cur, target):
+    """Pairs already exported to a directory -> {target article id: (source url, hash)}"""
+    cur.execute('select trg_id, src_url, hash from exports where target = ?', (target,))
+    return dict((trg_id, (src_url, h)) for trg_id, src_url, h in cur.fetchall())
+
+def set_exported_pairs(cur, target, pairs):
+    """Record (target article id, source url, hash) pairs exported to a directory"""
+    cur.executemany('insert or replace into exports(target, trg_id, src_url, hash)'
+            ' values (?, ?, ?, ?)', ((target,)+pair for pair in pairs))
+
+def translation_edges(cur):
+    """Iterate over the (url, url) links between stored articles: translation
+    links, which follow aliases (?p=<id> links prefer an article in the language
+    of the link), and links to the source article"""
+    queries = ['select l.url, s.url from links l'
+            ' left join aliases a on a.url = l.link'
+            ' join articles s on s.url = coalesce(a.canonical, l.link)'
+            ' where l.post_id is null',
+            'select l.url, s.url, min(s.lang != l.lang) from links l'
+            ' join articles s on s.id = l.post_id'
+            ' where l.post_id is not null group by l.url, l.lang',
+            'select t.url, s.url from articles t'
+            ' left join aliases a on a.url = t.source'
+            ' join articles s on s.url = coalesce(a.canonical, t.source)'
+            ' where t.source != t.url']
+    for query in queries:
+        cur.execute(query)
+        for rows in iter(lambda: cur.fetchmany(1000), []):
+            for row in rows:
+                yield row[0], row[1]
+
+def store_clusters(cur, clusters):
+    """Replace the translation clusters by (url, cluster) rows"""
+    cur.execute('delete from clusters')
+    cur.executemany('insert into clusters(url, cluster) values (?, ?)', clusters)
+
+def cluster_articles(cur):
+    """Iterate over (cluster, [articles]) in cluster order"""
+    columns = ', '.join('a.'+c for c in Article._fields)
+    cur.execute(('select c.cluster, {} from clusters c join articles a on a.url = c.url'
+        ' order by c.cluster, a.rowid').format(columns))
+    cluster, articles = None, []
+    for rows in iter(lambda: cur.fetchmany(1000), []):
+        for row in rows:
+            if row[0] != cluster:
+                if articles:
+                    yield cluster, articles
+                cluster, articles = row[0], []
+            articles.append(Article(*row[1:]))
+    if articles:
+        yield cluster, articles
+
+def compress_articles(conn, dictionary):
+    """Store the entries compressed with a new dictionary. The articles table
+    is replaced by a view of the metadata and compressed text tables the first
+    time; afterwards, the entries are compressed again with the new dictionary."""
+    compressed = _table_exists(conn, 'article_meta')
+    # DDL statements would commit the implicit transaction
+    isolation_level, conn.isolation_level = conn.isolation_level, None
+    try:
+        conn.execute('begin')
+        for statement in compressed_schema[:2]:
+            conn.execute(statement)
+        # Compressed entries start with their one-byte dictionary number
+        last, = conn.execute('select max(id) from compression_dicts').fetchone()
+        number = (last or 0) % 255 + 1
+        conn.execute('insert into compression_dicts(id, dictionary) values (?, ?)',
+                (number, buffer(dictionary)))
+        _set_codec(conn)
+        if compressed:
+            conn.execute('update article_body set entry = deflate(inflate(entry))')
+        else:
+            conn.execute(article_meta_table)
+            for name, column_type in added_columns:
+                conn.execute('alter table article_meta add column {} {}'.format(name, column_type))
+            conn.execute('insert into article_meta(rowid, {0}) select rowid, {0} from articles'
+                    .format(', '.join(meta_columns)))
+            conn.execute('insert into article_body(article, title, entry)'
+                    ' select rowid, title, deflate(entry) from articles')
+            conn.execute('drop table articles')
+            _create_schema(conn, True)
+        conn.execute('delete from compression_dicts where id != ?', (number,))
+        _set_codec(conn)
+        conn.execute('commit')
+    except:
+        conn.execute('rollback')
+        raise
+    finally:
+        conn.isolation_level = isolation_level
+
+def create_search_index(conn):
+    """Create the full-text index of the titles and entries, or build it again"""
+    with conn:
+        conn.execute(search_table)
+        _create_schema(conn, _table_exists(conn, 'article_meta'))
+        conn.execute("insert into article_search(article_search) values ('rebuild')")
+
+def has_search_index(conn):
+    return _table_exists(conn, 'article_search')
+
+def search(cur, query, lang=None, limit=20):
+    """Full-text search (FTS5 query syntax) -> [(url, lang, title, snippet)], best first"""
+    cur.execute('select a.url, a.lang, a.title,'
+            " snippet(article_search, 1, '[', ']', '...', 16) from article_search s"
+            ' join articles a on a.rowid = s.rowid'
+            ' where article_search match ? and coalesce(a.lang = ?, 1)'
+            ' order by s.rank limit ?', (query, lang, limit))
+    return cur.fetchall()
@@ -1,58 +1,117 @@
 import sys
 import os
-import re
-import sqlite3
+import hashlib
 import argparse
-from collections import namedtuple
+import itertools
+import multiprocessing
 import nltk
-from articles import Article, url_pattern
-
-id_pattern = re.compile('.*\?p=(\d+)$')
-
-def find_translation_url(article, lang):
-    for url in article.translations.split():
-        m = url_pattern.match(url)
-        if not m: continue
-        l = m.group(1)
-        l = 'en' if not l else l[:-1]
-        l = 'en' if l in ('rising', 'advocacy') else l
-        if l == lang:
-            return url
-
-def find_translation(article, lang, cur):
-    src_url = find_translation_url(article, lang)
-    if not src_url: return None
-    m = id_pattern.match(src_url)
-    if m:
-        aid = int(m.group(1))
-        cur.execute('select * from articles where id = ?', (aid,))
-    else:
-        cur.execute('select * from articles where url = ?', (src_url,))
-    row = cur.fetchone()
-    if row is not None:
-        return Article(*row)
+import database
+import instrument
+from articles import article_date
 
 # Aggressive tokenizer
 tokenizer = nltk.tokenize.RegexpTokenizer('(\w+|[^\s])')
 
-def write_article(article, untok, tok):
-    with open(untok, 'w') as f_untok, open(tok, 'w') as f_tok:
-        paragraphs = article.entry.split('\n')
-        paragraphs.insert(0, article.title.replace('\n', ' '))
-        for paragraph in paragraphs:
-            for sent in nltk.sent_tokenize(paragraph):
-                f_untok.write(sent.encode('utf8')+'\n')
-                f_tok.write(' '.join(tokenizer.tokenize(sent)).lower().encode('utf8')+'\n')
+def sentences(article):
+    """Split the title and paragraphs of an article into sentences"""
+    paragraphs = article.entry.split('\n')
+    paragraphs.insert(0, article.title.replace('\n', ' '))
+    with instrument.stage('sent_tokenize'):
+        return [sent for paragraph in paragraphs for sent in nltk.sent_tokenize(paragraph)]
+
+def segment(article):
+    """Split an article into sentences -> (untokenized, tokenized) text"""
+    untok, tok = [], []
+    sents = sentences(article)
+    with instrument.stage('tokenize'):
+        for sent in sents:
+            untok.append(sent.encode('utf8')+'\n')
+            tok.append(' '.join(tokenizer.tokenize(sent)).lower().encode('utf8')+'\n')
+    return ''.join(untok), ''.join(tok)
 
-year_re = re.compile('s-y(\d{4})')
-month_re = re.compile('s-m(\d{2})')
-day_re = re.compile('s-d(\d{2})')
+def segment_pair(pair):
+    trg, src = pair
+    return trg, src, segment(src), segment(trg)
+
+def parallel_map(pool, function, pairs, chunk_size=1024):
+    """Apply a function to pairs in a pool; the pairs are read in this thread (the
+    database cursor cannot be used from the pool's feeder thread) one chunk ahead."""
+    pending = []
+    while True:
+        chunk = list(itertools.islice(pairs, chunk_size))
+        results = pool.imap(function, chunk, chunksize=64) if chunk else []
+        for result in pending:
+            yield result
+        if not chunk:
+            break
+        pending = results
+
+def write_article(segmented, untok, tok):
+    untok_text, tok_text = segmented
+    with open(untok, 'w') as f_untok, open(tok, 'w') as f_tok:
+        f_untok.write(untok_text)
+        f_tok.write(tok_text)
 
 def date(article):
-    y = year_re.search(article.metadata).group(1)
-    m = month_re.search(article.metadata).group(1)
-    d = day_re.search(article.metadata).group(1)
-    return y+'-'+m+'-'+d
+    return '{:04}-{:02}-{:02}'.format(*article_date(article.metadata))
+
+def pair_hash(trg, src):
+    """Hash of the texts of an article pair, to find the pairs which changed"""
+    return hashlib.sha1(u'\0'.join((trg.title, trg.entry, src.title, src.entry))
+            .encode('utf8')).hexdigest()
+
+def changed_pairs(pairs, exported, new_pairs):
+    """Skip the pairs exported with the same texts (exported: see
+    database.exported_pairs); (target id, source url, hash) of the
+    others are appended to new_pairs"""
+    for trg, src in pairs:
+        h = pair_hash(trg, src)
+        if exported.get(trg.id) != (src.url, h):
+            new_pairs.append((trg.id, src.url, h))
+            yield trg, src
+
+class BidocWriter(object):
+    """Writes segmented article pairs into `target_dir`/corpus_to_align;
+    with `keep`, the pairs of a previous export which are still there (not
+    aligned and removed yet) are kept along with the new ones"""
+    def __init__(self, target_dir, keep=False):
+        main_dir = target_dir+'/corpus_to_align'
+        self.src_untok = main_dir+'/source_language_corpus_untokenized/'
+        self.src_tok = main_dir+'/source_language_corpus_prepared/'
+        self.trg_untok = main_dir+'/target_language_corpus_untokenized/'
+        self.trg_tok = main_dir+'/target_language_corpus_prepared/'
+        for d in (main_dir, self.src_untok, self.src_tok, self.trg_untok, self.trg_tok):
+            if not os.path.exists(d):
+                os.mkdir(d)
+        # {article id: line of align_info.txt} of the pairs kept
+        self.kept = {}
+        align_info = main_dir+'/align_info.txt'
+        if keep and os.path.exists(align_info):
+            with open(align_info) as f:
+                self.kept = dict((line.split('\t', 1)[0], line) for line in f)
+        # Replaced when closed, so that kept pairs are not lost on errors
+        self.align_info = align_info
+        self.f_align = open(align_info+'.tmp', 'w')
+        self.found = 0
+
+    def write(self, trg, src, src_text, trg_text):
+        self.found += 1
+        article_id = str(trg.id)
+        self.kept.pop(article_id, None)
+        with instrument.stage('write'):
+            write_article(src_text, self.src_untok+article_id+'.txt',
+                    self.src_tok+article_id+'.txt')
+            write_article(trg_text, self.trg_untok+article_id+'.txt',
+                    self.trg_tok+article_id+'.txt')
+            self.f_align.write('{}\t{}\t{}\t{}\n'.format(article_id, src.url, trg.url,
+                date(trg)))
+        instrument.count('pairs')
+
+    def close(self):
+        for line in self.kept.itervalues():
+            self.f_align.write(line)
+        self.f_align.close()
+        os.rename(self.align_info+'.tmp', self.align_info)
 
 def main():
     parser = argparse.ArgumentParser(description='Write articles to disk for alignment')
@@ -60,43 +119,52 @@ def main():
     parser.add_argument('trg_lang', help='target language - translated [sw]')
     parser.add_argument('database', help='database path to read articles from')
     parser.add_argument('target_dir', help='target directory to write articles to')
+    parser.add_argument('--workers', type=int, default=1,
+            help='number of processes splitting articles into sentences')
+    parser.add_argument('--incremental', action='store_true',
+            help='only write the pairs which are new or changed since the last export '
+            'to this directory; they are added to the pairs of the previous export, '
+            'which should be removed once aligned')
+    instrument.add_arguments(parser)
     args = parser.parse_args()
+    instrument.start(args)
+
+    conn = database.connect(args.database)
+    cur = conn.cursor()
+
+    writer = BidocWriter(args.target_dir, keep=args.incremental)
+
+    cur.execute('select count(*) from articles where lang = ?', (args.trg_lang,))
+    total, = cur.fetchone()
+    pairs = instrument.timed_iter('query', database.article_pairs(cur, args.trg_lang,
+        args.src_lang))
+    target = os.path.abspath(args.target_dir)
+    new_pairs = []
+    if args.incremental:
+        exported = database.exported_pairs(conn.cursor(), target)
+        pairs = changed_pairs(pairs, exported, new_pairs)
+    # Articles are segmented in parallel; files are written by this process
+    if args.workers > 1:
+        pool = multiprocessing.Pool(args.workers)
+        segmented = parallel_map(pool, segment_pair, pairs)
+    else:
+        pool = None
+        segmented = itertools.imap(segment_pair, pairs)
+
+    # With --workers, the time of the stages run by the workers is not measured
+    # separately: 'segment' is the time spent waiting for them
+    for (trg, src, src_text, trg_text) in instrument.timed_iter('segment', segmented):
+        writer.write(trg, src, src_text, trg_text)
+    writer.close()
+    if args.incremental:
+        with conn:
+            database.set_exported_pairs(conn.cursor(), target, new_pairs)
+
+    if pool is not None:
+        pool.close()
+        pool.join()
 
-    conn = sqlite3.connect(args.database)
-    trg_cur = conn.cursor()
-    src_cur = conn.cursor()
-
-    def article_pairs(trg_lang, src_lang):
-        trg_cur.execute('select * from articles where lang = ?', (trg_lang,))
-        for article in trg_cur.fetchall():
-            trg_article = Article(*article)
-            src_article = find_translation(trg_article, src_lang, src_cur)
-            yield trg_article, src_article
-
-    main_dir = args.target_dir+'/corpus_to_align'
-    src_untok = main_dir+'/source_language_corpus_untokenized/'
-    src_tok = main_dir+'/source_language_corpus_prepared/'
-    trg_untok = main_dir+'/target_language_corpus_untokenized/'
-    trg_tok = main_dir+'/target_language_corpus_prepared/'
-    align_info = main_dir+'/align_info.txt'
-
-    for d in (main_dir, src_untok, src_tok, trg_untok, trg_tok):
-        if not os.path.exists(d):
-            os.mkdir(d)
-
-    found, not_found = 0, 0
-    with open(align_info, 'w') as f_align:
-        for (trg, src) in article_pairs(args.trg_lang, args.src_lang):
-            if not src:
-                not_found += 1
-                continue
-            found += 1
-            article_id = str(trg.id)
-            write_article(src, src_untok+article_id+'.txt', src_tok+article_id+'.txt')
-            write_article(trg, trg_untok+article_id+'.txt', trg_tok+article_id+'.txt')
-            f_align.write('{}\t{}\t{}\t{}\n'.format(article_id, src.url, trg.url, date(trg)))
-
-    print('Articles with translation written to disk: {}/{}'.format(found, found+not_found))
+    print('Articles with translation written to disk: {}/{}'.format(writer.found, total))
 
 if __name__ == '__main__':
     main()
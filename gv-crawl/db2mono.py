@@ -1,21 +1,74 @@
-import sqlite3
 import argparse
-from articles import Article
+import datetime
+import database
+import instrument
+from output import OutputWriter, HashSet
+
+def partial_date(value):
+    '''YYYY[-MM[-DD]] -> (year, month, day), None for the missing parts'''
+    try:
+        parts = map(int, value.split('-'))
+        if not 1 <= len(parts) <= 3:
+            raise ValueError
+        year, month, day = parts + [None] * (3 - len(parts))
+        datetime.date(year, month or 1, day or 1)
+    except ValueError:
+        raise argparse.ArgumentTypeError('invalid date %r, expected YYYY[-MM[-DD]]' % value)
+    return year, month, day
 
 def main():
     parser = argparse.ArgumentParser(description='Dump all text')
     parser.add_argument('database', help='database to read articles from')
     parser.add_argument('lang', help='language to get articles for')
+    parser.add_argument('--output', help='output file prefix (default: stdout)')
+    parser.add_argument('--gzip', action='store_true', help='compress the output')
+    parser.add_argument('--shard-mb', type=int,
+            help='split the output into files of this size (requires --output)')
+    parser.add_argument('--dedup', action='store_true',
+            help='remove duplicate lines')
+    parser.add_argument('--since', type=partial_date,
+            help='only export articles published on or after YYYY[-MM[-DD]]')
+    parser.add_argument('--until', type=partial_date,
+            help='only export articles published on or before YYYY[-MM[-DD]]')
+    parser.add_argument('--chunk-size', type=int, default=1000,
+            help='number of articles read from the database at once')
+    instrument.add_arguments(parser)
     args = parser.parse_args()
+    instrument.start(args)
+
+    if args.shard_mb and not args.output:
+        parser.error('--shard-mb requires --output')
 
-    conn = sqlite3.connect(args.database)
+    conn = database.connect(args.database)
     cur = conn.cursor()
 
-    cur.execute('select * from articles where lang = ?', (args.lang,))
+    query, params = 'select entry from articles where lang = ?', [args.lang]
+    if args.since:
+        query += ' and (year, month, day) >= (?, ?, ?)'
+        year, month, day = args.since
+        params.extend([year, month or 1, day or 1])
+    if args.until:
+        # A partial date includes the whole month or year
+        query += ' and (year, month, day) <= (?, ?, ?)'
+        year, month, day = args.until
+        params.extend([year, month or 12, day or 31])
+    cur.execute(query, params)
 
-    for article in cur.fetchall():
-        article = Article(*article)
-        print(article.entry.encode('utf8'))
+    out = OutputWriter(args.output, suffix='.txt' if args.output else '',
+            compress=args.gzip,
+            shard_size=(args.shard_mb * 1024 * 1024 if args.shard_mb else None))
+    seen = HashSet() if args.dedup else None
+    chunks = instrument.timed_iter('query', iter(lambda: cur.fetchmany(args.chunk_size), []))
+    for rows in chunks:
+        instrument.count('articles', len(rows))
+        for (entry,) in rows:
+            if seen is None:
+                out.write(entry.encode('utf8')+'\n')
+                continue
+            lines = [line for line in entry.split('\n') if seen.add(hash(line))]
+            if lines:
+                out.write('\n'.join(lines).encode('utf8')+'\n')
+    out.close()
 
 if __name__ == '__main__':
     main()
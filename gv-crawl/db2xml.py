@@ -0,0 +1,58 @@
+import argparse
+import itertools
+import multiprocessing
+import database
+import aligner
+import instrument
+from db2bidoc import sentences, date, parallel_map
+from align2xml import add_output_arguments, make_writer
+
+def align_pair(pair):
+    trg, src = pair
+    src_sents, trg_sents = sentences(src), sentences(trg)
+    with instrument.stage('align'):
+        return trg, src, aligner.align_sentences(src_sents, trg_sents)
+
+def main():
+    parser = argparse.ArgumentParser(description='Align articles from the database and convert them to XML')
+    parser.add_argument('src_lang', help='source language - original [en]')
+    parser.add_argument('trg_lang', help='target language - translated [sw]')
+    parser.add_argument('database', help='database path to read articles from')
+    parser.add_argument('--src-iso', help='ISO code for source language in the output [eng]')
+    parser.add_argument('--trg-iso', help='ISO code for target language in the output [swa]')
+    parser.add_argument('--workers', type=int, default=1,
+            help='number of processes aligning articles')
+    add_output_arguments(parser)
+    instrument.add_arguments(parser)
+    args = parser.parse_args()
+    instrument.start(args)
+
+    writer = make_writer(parser, args, args.src_iso or args.src_lang,
+            args.trg_iso or args.trg_lang)
+
+    conn = database.connect(args.database)
+    cur = conn.cursor()
+
+    # Articles are aligned in parallel; the output is written by this process
+    pairs = instrument.timed_iter('query', database.article_pairs(cur, args.trg_lang,
+        args.src_lang))
+    if args.workers > 1:
+        pool = multiprocessing.Pool(args.workers)
+        aligned = parallel_map(pool, align_pair, pairs)
+    else:
+        pool = None
+        aligned = itertools.imap(align_pair, pairs)
+
+    # With --workers, 'align_pairs' is the time spent waiting for the workers
+    for trg, src, units in instrument.timed_iter('align_pairs', aligned):
+        with instrument.stage('write'):
+            writer.write_document(trg.id, (src.url, trg.url, date(trg)), units)
+        instrument.count('pairs')
+    writer.close()
+
+    if pool is not None:
+        pool.close()
+        pool.join()
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,53 @@
+'''
+Compress the entries of an articles database.
+
+The entries are deflated with a dictionary of frequent strings trained on a
+sample of the articles (see compression.py), and the metadata columns are
+stored apart from the texts, so that the queries which only use them read
+less. The `articles` view has the same columns as the table of uncompressed
+databases, so the other scripts work on both. Running it again on a
+compressed database trains a new dictionary (e.g. after loading articles in
+new languages).
+'''
+import os
+import argparse
+import database
+import compression
+import instrument
+
+def main():
+    parser = argparse.ArgumentParser(description='Compress the entries of an articles database')
+    parser.add_argument('database', help='articles database')
+    parser.add_argument('--sample', type=int, default=1000,
+            help='number of articles the dictionary is trained on')
+    parser.add_argument('--dict-size', type=int, default=compression.max_dictionary_size,
+            help='maximum size of the dictionary in bytes')
+    instrument.add_arguments(parser)
+    args = parser.parse_args()
+    instrument.start(args)
+
+    if not 0 < args.dict_size <= compression.max_dictionary_size:
+        parser.error('--dict-size must be between 1 and {}'.format(
+            compression.max_dictionary_size))
+
+    size = os.path.getsize(args.database)
+    conn = database.connect(args.database)
+    with instrument.stage('train'):
+        texts = [entry for entry, in conn.execute('select entry from articles where rowid in'
+            ' (select rowid from articles order by random() limit ?)', (args.sample,))]
+        dictionary = compression.train_dictionary(texts, args.dict_size)
+    with instrument.stage('compress'):
+        database.compress_articles(conn, dictionary)
+    n_articles, = conn.execute('select count(*) from article_body').fetchone()
+    instrument.count('articles', n_articles)
+    with instrument.stage('vacuum'):
+        conn.execute('vacuum')
+    conn.close()
+
+    print('Articles compressed: {} (dictionary: {} bytes from {} articles)'.format(
+        n_articles, len(dictionary), len(texts)))
+    print('Database size: {:.1f} MB => {:.1f} MB'.format(size / 1048576.0,
+        os.path.getsize(args.database) / 1048576.0))
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,53 @@
+'''
+Full-text search of the articles of all languages.
+
+`index` creates the FTS5 index of the titles and entries (or builds it again);
+it is then kept up to date when articles are inserted. `query` prints the
+best matching articles with an excerpt. Queries use the FTS5 syntax, e.g.
+`"free speech" OR censorship`, `title:election`, `blog*`.
+'''
+import sqlite3
+import argparse
+import database
+import instrument
+
+def main():
+    parser = argparse.ArgumentParser(description='Search the articles database')
+    subparsers = parser.add_subparsers(dest='command')
+    index_parser = subparsers.add_parser('index', help='create the full-text index')
+    index_parser.add_argument('database', help='articles database')
+    query_parser = subparsers.add_parser('query', help='print the articles matching a query')
+    query_parser.add_argument('database', help='articles database')
+    query_parser.add_argument('query', help='FTS5 query')
+    query_parser.add_argument('--lang', help='only search the articles in this language')
+    query_parser.add_argument('--limit', type=int, default=20,
+            help='maximum number of articles printed')
+    for subparser in (index_parser, query_parser):
+        instrument.add_arguments(subparser)
+    args = parser.parse_args()
+    instrument.start(args)
+
+    conn = database.connect(args.database)
+
+    if args.command == 'index':
+        with instrument.stage('index'):
+            database.create_search_index(conn)
+        n_articles, = conn.execute('select count(*) from articles').fetchone()
+        instrument.count('articles', n_articles)
+        print('Articles indexed: {}'.format(n_articles))
+        return
+
+    if not database.has_search_index(conn):
+        parser.error('the database has no full-text index (see db_search.py index)')
+    try:
+        with instrument.stage('query'):
+            results = database.search(conn.cursor(), args.query.decode('utf8'), args.lang,
+                    args.limit)
+    except sqlite3.OperationalError as e:
+        parser.error('invalid query: {}'.format(e))
+    for url, lang, title, snippet in results:
+        print(u'{}\t{}\t{}\n    {}'.format(url, lang, title, snippet.replace('\n', ' '))
+                .encode('utf8'))
+
+if __name__ == '__main__':
+    main()
@@ -1,34 +1,29 @@
-import sqlite3
 import argparse
-from util import Article
-from collections import defaultdict
+import itertools
+import database
+import instrument
 
 def main():
-    parser = argparse.ArgumentParser(description='Dump all text')
+    parser = argparse.ArgumentParser(description='Count articles per month')
     parser.add_argument('database', help='database to read articles from')
     parser.add_argument('lang', help='language to get articles for')
+    instrument.add_arguments(parser)
     args = parser.parse_args()
+    instrument.start(args)
 
-    conn = sqlite3.connect(args.database)
+    conn = database.connect(args.database)
     cur = conn.cursor()
 
-    cur.execute('select metadata from articles where lang = ?', (args.lang,))
-    print('Total: {}'.format(cur.rowcount))
+    cur.execute('select count(*) from articles where lang = ?', (args.lang,))
+    print('Total: {}'.format(cur.fetchone()[0]))
 
-    years = defaultdict(lambda: defaultdict(list))
+    cur.execute('select year, month, n from article_counts where lang = ? and n > 0'
+            ' order by year, month', (args.lang,))
 
-    for (meta,) in cur.fetchall():
-        if not meta: continue
-        m = {}
-        for item in meta.split():
-            if item[:3] in ('s-y', 's-m', 's-d'):
-                m[item[2]] = int(item[3:])
-        years[m['y']][m['m']].append(m['d'])
-
-    for y, months in sorted(years.iteritems()):
-        y_total = sum(map(len, months.itervalues()))
-        m_info = ', '.join('{:0>2}: {}'.format(m, len(days))
-                for m, days in sorted(months.iteritems()))
+    for y, months in itertools.groupby(cur.fetchall(), lambda row: row[0]):
+        months = [(m, n) for _, m, n in months]
+        y_total = sum(n for _, n in months)
+        m_info = ', '.join('{:0>2}: {}'.format(m, n) for m, n in months)
         print('{}: {} | {}'.format(y, y_total, m_info))
 
 if __name__ == '__main__':
@@ -0,0 +1,128 @@
+'''
+Set of URLs already stored by the crawler, with their HTTP validators.
+
+Lookups are answered by an in-memory Bloom filter; only possible hits go to
+the SQLite table, so the cost per page does not grow with the index.
+'''
+import os
+import math
+import struct
+import hashlib
+import sqlite3
+
+class BloomFilter(object):
+    '''Bloom filter over byte strings with `n_hashes` double-hashed positions'''
+    def __init__(self, capacity, error_rate=0.001):
+        self.capacity = capacity
+        self.n_bits = int(-capacity * math.log(error_rate) / math.log(2) ** 2)
+        self.n_hashes = max(1, int(round(self.n_bits * math.log(2) / capacity)))
+        self.bits = bytearray((self.n_bits + 7) // 8)
+
+    def _positions(self, key):
+        h1, h2 = struct.unpack('<QQ', hashlib.md5(key).digest())
+        return [(h1 + i * h2) % self.n_bits for i in xrange(self.n_hashes)]
+
+    def add(self, key):
+        for p in self._positions(key):
+            self.bits[p >> 3] |= 1 << (p & 7)
+
+    def __contains__(self, key):
+        return all(self.bits[p >> 3] & (1 << (p & 7)) for p in self._positions(key))
+
+def open_validators(path):
+    '''Opens an existing index to look up validators without loading or
+    changing it -> connection for `stored_validators`, or None'''
+    if not os.path.exists(path):
+        return None
+    conn = sqlite3.connect(path)
+    if conn.execute("select 1 from sqlite_master where name = 'validators'").fetchone() is None:
+        conn.close()
+        return None
+    return conn
+
+def stored_validators(conn, url):
+    '''Returns (ETag, Last-Modified, body digest) stored for `url`, or None'''
+    return conn.execute('select etag, last_modified, digest from validators'
+            ' where url = ?', (url,)).fetchone()
+
+class DedupIndex(object):
+    '''URL set stored in a SQLite (WAL) table with a Bloom filter in front.
+
+    `path`          SQLite database path
+    `commit_every`  Number of added URLs committed together
+    `capacity`      Initial capacity of the Bloom filter; it is rebuilt with
+                    twice the size when the number of URLs exceeds it
+    '''
+    def __init__(self, path, commit_every=1000, capacity=1000000):
+        self.conn = sqlite3.connect(path)
+        self.conn.execute('pragma journal_mode = wal')
+        self.conn.execute('pragma synchronous = normal')
+        self.conn.execute('create table if not exists urls(url text primary key)')
+        self.conn.execute('create table if not exists validators(url text primary key,'
+                ' etag text, last_modified text, digest text)')
+        self.conn.commit()
+        self.commit_every = commit_every
+        self.pending = set()
+        self.pending_validators = {}
+        self.count = self.conn.execute('select count(*) from urls').fetchone()[0]
+        self._rebuild(max(capacity, 2 * self.count))
+
+    @staticmethod
+    def _key(url):
+        return url.encode('utf8') if isinstance(url, unicode) else url
+
+    def _rebuild(self, capacity):
+        '''Fills a new Bloom filter from the table'''
+        self.bloom = BloomFilter(capacity)
+        for (url,) in self.conn.execute('select url from urls'):
+            self.bloom.add(self._key(url))
+        for url in self.pending:
+            self.bloom.add(self._key(url))
+
+    def __contains__(self, url):
+        if self._key(url) not in self.bloom:
+            return False
+        if url in self.pending:
+            return True
+        return self.conn.execute('select 1 from urls where url = ?', (url,)).fetchone() is not None
+
+    def add(self, url):
+        self.bloom.add(self._key(url))
+        self.pending.add(url)
+        self.count += 1
+        if len(self.pending) >= self.commit_every:
+            self.flush()
+        if self.count > self.bloom.capacity:
+            self._rebuild(2 * self.bloom.capacity)
+
+    def update(self, urls):
+        for url in urls:
+            if url not in self:
+                self.add(url)
+
+    def validators(self, url):
+        '''Returns (ETag, Last-Modified, body digest) stored for `url`, or None'''
+        if url in self.pending_validators:
+            return self.pending_validators[url]
+        return stored_validators(self.conn, url)
+
+    def set_validators(self, url, etag, last_modified, digest):
+        self.pending_validators[url] = (etag, last_modified, digest)
+        if len(self.pending_validators) >= self.commit_every:
+            self.flush()
+
+    def flush(self):
+        if not (self.pending or self.pending_validators):
+            return
+        with self.conn:
+            self.conn.executemany('insert or ignore into urls(url) values (?)',
+                    ((url,) for url in self.pending))
+            self.conn.executemany('insert or replace into validators(url, etag,'
+                    ' last_modified, digest) values (?, ?, ?, ?)',
+                    ((url,)+v for url, v in self.pending_validators.iteritems()))
+        self.pending = set()
+        self.pending_validators = {}
+
+    def close(self):
+        self.flush()
+        self.conn.close()
@@ -0,0 +1,58 @@
+'''
+Fingerprints of article texts for duplicate detection.
+
+`content_hash` identifies texts which are identical up to case, punctuation
+and whitespace. `simhash` (Charikar, 2002) gives 64-bit fingerprints which
+differ in few bits for near-identical texts: two fingerprints within
+`max_distance` bits share at least one of their `n_bands` bands, which are
+used as index keys to find the candidates.
+'''
+import re
+import hashlib
+import numpy
+
+words_re = re.compile(r'\w+', re.UNICODE)
+
+shingle_size = 3
+n_bands = 4
+band_bits = 64 // n_bands
+max_distance = 3
+# Shorter texts are not fingerprinted (too many false duplicates)
+min_words = 20
+
+def normalize(text):
+    return words_re.findall(text.lower())
+
+def content_hash(words):
+    return hashlib.sha1(u' '.join(words).encode('utf8')).hexdigest()
+
+def simhash(words):
+    '''64-bit SimHash of the word shingles of a text'''
+    shingles = [u' '.join(words[i:i+shingle_size])
+            for i in xrange(max(1, len(words) - shingle_size + 1))]
+    digests = ''.join(hashlib.md5(s.encode('utf8')).digest()[:8] for s in shingles)
+    hashes = numpy.frombuffer(digests, dtype='<u8')
+    bits = (hashes[:, numpy.newaxis] >> numpy.arange(64, dtype=numpy.uint64)) & numpy.uint64(1)
+    majority = 2 * bits.sum(axis=0) > len(shingles)
+    return sum(1 << int(i) for i in numpy.flatnonzero(majority))
+
+def fingerprint(text):
+    '''-> (content hash, simhash), or (None, None) for short texts'''
+    words = normalize(text or u'')
+    if len(words) < min_words:
+        return None, None
+    return content_hash(words), simhash(words)
+
+def bands(h):
+    mask = (1 << band_bits) - 1
+    return [(h >> (i * band_bits)) & mask for i in xrange(n_bands)]
+
+def distance(h1, h2):
+    return bin(h1 ^ h2).count('1')
+
+# SQLite integers are signed
+def to_signed(h):
+    return h - (1 << 64) if h is not None and h >= 1 << 63 else h
+
+def from_signed(h):
+    return h + (1 << 64) if h is not None and h < 0 else h
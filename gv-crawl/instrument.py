@@ -0,0 +1,195 @@
+'''
+Stage timers, counters and profilers shared by the command line scripts.
+
+Scripts add the options with `add_arguments` and call `start` after parsing
+them. The time spent in the named stages of the hot paths (`stage`,
+`timed_iter`) and the counters (`count`) are then accumulated, and written at
+exit with the total time, the rate of every counter and the peak memory
+(`--stats-json`). `--profile` saves a cProfile profile of the whole run and
+`--profile-sample` samples the Python stack of the main thread at regular
+intervals of CPU time (collapsed stacks, as read by flamegraph.pl).
+
+Stages can be nested: the time of a stage includes the time of the stages run
+inside it. The stages run in worker processes are only counted when the
+workers send them back (`collect` in the worker, `merge` in the main process).
+'''
+import os
+import sys
+import json
+import time
+import atexit
+import signal
+import resource
+import cProfile
+from collections import defaultdict, Counter
+
+enabled = False
+times = defaultdict(float)
+calls = defaultdict(int)
+counters = defaultdict(int)
+
+class _Stage(object):
+    __slots__ = ('name', 'start')
+
+    def __init__(self, name):
+        self.name = name
+
+    def __enter__(self):
+        self.start = time.time()
+
+    def __exit__(self, *exc_info):
+        times[self.name] += time.time() - self.start
+        calls[self.name] += 1
+
+class _NoStage(object):
+    def __enter__(self):
+        pass
+
+    def __exit__(self, *exc_info):
+        pass
+
+_no_stage = _NoStage()
+
+def stage(name):
+    '''with stage(name): adds the time spent in the block to the stage'''
+    return _Stage(name) if enabled else _no_stage
+
+def _timed_iter(name, iterator):
+    while True:
+        start = time.time()
+        try:
+            item = next(iterator)
+        except StopIteration:
+            return
+        finally:
+            times[name] += time.time() - start
+            calls[name] += 1
+        yield item
+
+def timed_iter(name, iterable):
+    '''Iterates over `iterable`, adding the time spent producing the items to the stage'''
+    if not enabled:
+        return iter(iterable)
+    return _timed_iter(name, iter(iterable))
+
+def count(name, n=1):
+    if enabled:
+        counters[name] += n
+
+def collect():
+    '''Stage times and counters measured so far, which are reset'''
+    snapshot = (dict(times), dict(calls), dict(counters))
+    times.clear()
+    calls.clear()
+    counters.clear()
+    return snapshot
+
+def merge(snapshot):
+    '''Adds the stage times and counters of `collect` (e.g. from a worker process)'''
+    stage_times, stage_calls, stage_counters = snapshot
+    for name, seconds in stage_times.iteritems():
+        times[name] += seconds
+    for name, n in stage_calls.iteritems():
+        calls[name] += n
+    for name, n in stage_counters.iteritems():
+        counters[name] += n
+
+class Sampler(object):
+    '''Statistical profiler counting the stacks of the main thread every
+    `interval` seconds of CPU time'''
+    def __init__(self, interval=0.005):
+        self.interval = interval
+        self.stacks = Counter()
+
+    def _sample(self, signum, frame):
+        stack = []
+        while frame is not None:
+            code = frame.f_code
+            stack.append('{}:{}:{}'.format(os.path.basename(code.co_filename),
+                code.co_name, code.co_firstlineno))
+            frame = frame.f_back
+        self.stacks[';'.join(reversed(stack))] += 1
+
+    def start(self):
+        signal.signal(signal.SIGPROF, self._sample)
+        # Restart the system calls interrupted by a sample
+        signal.siginterrupt(signal.SIGPROF, False)
+        signal.setitimer(signal.ITIMER_PROF, self.interval, self.interval)
+
+    def stop(self):
+        signal.setitimer(signal.ITIMER_PROF, 0, 0)
+        signal.signal(signal.SIGPROF, signal.SIG_DFL)
+
+    def write(self, path):
+        with open(path, 'w') as f:
+            for stack, n in sorted(self.stacks.iteritems()):
+                f.write('{} {}\n'.format(stack, n))
+
+def add_arguments(parser):
+    group = parser.add_argument_group('profiling')
+    group.add_argument('--stats-json', metavar='FILE',
+            help='write the time spent in each stage, the number of items processed '
+            'per second and the peak memory to this JSON file at the end of the run '
+            '(- for stderr)')
+    group.add_argument('--profile', metavar='FILE',
+            help='save a cProfile profile of the run to this file (see python -m pstats)')
+    group.add_argument('--profile-sample', metavar='FILE',
+            help='sample the Python stack while running and write the collapsed '
+            'stacks to this file (see flamegraph.pl)')
+    group.add_argument('--profile-interval', type=float, default=0.005,
+            help='seconds of CPU time between two samples of --profile-sample')
+
+def report(wall):
+    '''-> statistics of the run, written by --stats-json'''
+    usage = resource.getrusage(resource.RUSAGE_SELF)
+    children = resource.getrusage(resource.RUSAGE_CHILDREN)
+    return {
+        'script': os.path.basename(sys.argv[0]),
+        'argv': sys.argv[1:],
+        'wall': wall,
+        'user': usage.ru_utime + children.ru_utime,
+        'sys': usage.ru_stime + children.ru_stime,
+        # ru_maxrss is in kB on Linux
+        'peak_rss_mb': usage.ru_maxrss / 1024.0,
+        'children_peak_rss_mb': children.ru_maxrss / 1024.0,
+        'stages': dict((name, {'seconds': seconds, 'calls': calls[name],
+            'share': seconds / max(wall, 1e-6)}) for name, seconds in times.iteritems()),
+        'counters': dict(counters),
+        'rates': dict((name, n / max(wall, 1e-6)) for name, n in counters.iteritems()),
+    }
+
+def _write_report(path, wall):
+    result = json.dumps(report(wall), indent=1, sort_keys=True)
+    if path == '-':
+        sys.stderr.write(result+'\n')
+        return
+    with open(path, 'w') as f:
+        f.write(result+'\n')
+
+def start(args):
+    '''Starts the measures requested by the options of `add_arguments`;
+    the results are written when the process exits'''
+    global enabled
+    begin = time.time()
+    profile = sampler = None
+    if args.stats_json:
+        enabled = True
+    if args.profile:
+        profile = cProfile.Profile()
+        profile.enable()
+    if args.profile_sample:
+        sampler = Sampler(args.profile_interval)
+        sampler.start()
+
+    def finish():
+        if profile is not None:
+            profile.disable()
+            profile.dump_stats(args.profile)
+        if sampler is not None:
+            sampler.stop()
+            sampler.write(args.profile_sample)
+        if args.stats_json:
+            _write_report(args.stats_json, time.time() - begin)
+
+    if profile or sampler or args.stats_json:
+        atexit.register(finish)
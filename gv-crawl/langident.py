@@ -0,0 +1,177 @@
+'''
+Cached and batched language identification with langid.
+
+The langid model is only loaded when a text is first classified. Its decoded
+weights are cached on disk (in $GV_LANGID_CACHE, ~/.cache/gv-crawl/langid by
+default) and memory-mapped, so that processes share them instead of decoding
+the model again.
+'''
+import os
+import hashlib
+import sqlite3
+import tempfile
+import cPickle
+from collections import OrderedDict
+import numpy
+import instrument
+
+model_cache = os.environ.get('GV_LANGID_CACHE',
+        os.path.expanduser('~/.cache/gv-crawl/langid'))
+
+_identifier = None
+
+def norm_probs(vals):
+    # Fix langid probability normalization
+    return numpy.exp(vals - numpy.logaddexp.reduce(vals))
+
+def _save_model(identifier, model_dir):
+    parent = os.path.dirname(model_dir)
+    if not os.path.exists(parent):
+        os.makedirs(parent)
+    tmp_dir = tempfile.mkdtemp(dir=parent)
+    numpy.save(os.path.join(tmp_dir, 'nb_ptc.npy'), identifier.nb_ptc)
+    with open(os.path.join(tmp_dir, 'model.pickle'), 'wb') as f:
+        cPickle.dump((identifier.nb_pc, identifier.nb_numfeats, identifier.nb_classes,
+            identifier.tk_nextmove, identifier.tk_output), f, cPickle.HIGHEST_PROTOCOL)
+    try:
+        os.rename(tmp_dir, model_dir)
+    except OSError: # saved concurrently by another process
+        for fn in os.listdir(tmp_dir):
+            os.remove(os.path.join(tmp_dir, fn))
+        os.rmdir(tmp_dir)
+
+def _load_model(model_dir):
+    from langid.langid import LanguageIdentifier
+    nb_ptc = numpy.load(os.path.join(model_dir, 'nb_ptc.npy'), mmap_mode='r')
+    with open(os.path.join(model_dir, 'model.pickle'), 'rb') as f:
+        nb_pc, nb_numfeats, nb_classes, tk_nextmove, tk_output = cPickle.load(f)
+    return LanguageIdentifier(nb_ptc, nb_pc, nb_numfeats, nb_classes, tk_nextmove, tk_output)
+
+def load_identifier(cache_dir=model_cache):
+    '''Loads the langid model, from the on-disk cache when possible'''
+    import langid.langid
+    model_dir = os.path.join(cache_dir, hashlib.sha1(langid.langid.model).hexdigest()[:16])
+    try:
+        identifier = _load_model(model_dir)
+    except (IOError, OSError):
+        langid.langid.load_model()
+        identifier = langid.langid.identifier
+        try:
+            _save_model(identifier, model_dir)
+        except (IOError, OSError):
+            pass
+    identifier.norm_probs = norm_probs
+    return identifier
+
+def identifier():
+    global _identifier
+    if _identifier is None:
+        _identifier = load_identifier()
+    return _identifier
+
+def classify(text):
+    model = identifier()
+    with instrument.stage('langid'):
+        return model.classify(text)
+
+def classify_batch(texts):
+    '''Classifies several texts at once -> [(lang, confidence)]
+
+    Gives the same result as `classify` on each text, but scores all
+    the feature vectors with a single matrix product.
+    '''
+    if not texts:
+        return []
+    model = identifier()
+    with instrument.stage('langid'):
+        fv = numpy.array([model.instance2fv(text) for text in texts])
+        pd = numpy.dot(fv, model.nb_ptc) + model.nb_pc
+        probs = numpy.exp(pd - numpy.logaddexp.reduce(pd, axis=1)[:, numpy.newaxis])
+        best = probs.argmax(axis=1)
+    return [(str(model.nb_classes[c]), float(probs[i, c])) for i, c in enumerate(best)]
+
+class LanguageCache(object):
+    '''LRU cache of language identification results keyed on a hash of the text.
+
+    `size`  Maximum number of results kept in memory
+    `path`  Optional SQLite database where results are persisted. It can be
+            shared by several processes.
+    '''
+    def __init__(self, size=100000, path=None):
+        self.size = size
+        self.entries = OrderedDict()
+        self.pending = []
+        self.path = path
+        self._conn = None
+
+    @property
+    def conn(self):
+        # Connect on first use so that the cache can be created before forking
+        if self._conn is None and self.path:
+            self._conn = sqlite3.connect(self.path, timeout=60)
+            self._conn.execute('create table if not exists langid(hash text primary key,'
+                    ' lang text, conf real)')
+            self._conn.commit()
+        return self._conn
+
+    @staticmethod
+    def key(text):
+        return hashlib.sha1(text.encode('utf8')).hexdigest()
+
+    def _store(self, key, value):
+        self.entries[key] = value
+        if len(self.entries) > self.size:
+            self.entries.popitem(last=False)
+
+    def get(self, key):
+        value = self.entries.pop(key, None)
+        if value is not None:
+            self.entries[key] = value
+            return value
+        if self.conn is not None:
+            row = self.conn.execute('select lang, conf from langid where hash = ?',
+                    (key,)).fetchone()
+            if row is not None:
+                value = (str(row[0]), row[1])
+                self._store(key, value)
+                return value
+
+    def put(self, key, value):
+        self._store(key, value)
+        if self.path:
+            self.pending.append((key,)+value)
+
+    def classify(self, text):
+        key = self.key(text)
+        value = self.get(key)
+        if value is None:
+            value = classify(text)
+            self.put(key, value)
+        return value
+
+    def classify_batch(self, texts):
+        '''Classifies several texts, scoring all the cache misses in one batch'''
+        keys = [self.key(text) for text in texts]
+        values = [self.get(key) for key in keys]
+        misses = [i for i, value in enumerate(values) if value is None]
+        for i, value in zip(misses, classify_batch([texts[i] for i in misses])):
+            values[i] = value
+            self.put(keys[i], value)
+        return values
+
+    def flush(self):
+        '''Writes new results to the database'''
+        if not self.pending:
+            return
+        with self.conn:
+            self.conn.executemany('insert or ignore into langid(hash, lang, conf)'
+                    ' values (?, ?, ?)', self.pending)
+        self.pending = []
+
+cache = LanguageCache()
+
+def configure(size=100000, path=None):
+    '''Replaces the default cache'''
+    global cache
+    cache.flush()
+    cache = LanguageCache(size, path)
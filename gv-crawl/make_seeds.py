@@ -1,8 +1,49 @@
 #!/usr/bin/env python
 import sys
+import datetime
+import argparse
 import lxml.etree as et
+import instrument
+
+def months(start, end):
+    '''Iterates over (year, month) from `start` to `end` (YYYY-MM), inclusive'''
+    y, m = map(int, start.split('-'))
+    end_y, end_m = map(int, end.split('-'))
+    while (y, m) <= (end_y, end_m):
+        yield y, m
+        y, m = (y, m + 1) if m < 12 else (y + 1, 1)
+
+def site_seeds(site, archives=None, feed_pages=0, sitemap=False):
+    '''Independent entry points of a website: monthly archives, feed pages, sitemap'''
+    site = site.rstrip('/')
+    if archives:
+        start, _, end = archives.partition(':')
+        end = end or datetime.date.today().strftime('%Y-%m')
+        for y, m in months(start, end):
+            yield '{}/{:04}/{:02}/'.format(site, y, m)
+    for page in range(1, feed_pages + 1):
+        yield '{}/feed/'.format(site) + ('?paged={}'.format(page) if page > 1 else '')
+    if sitemap:
+        yield '{}/sitemap.xml'.format(site)
 
 def main():
+    parser = argparse.ArgumentParser(description='Print seed URLs from the RSS feed on stdin'
+            ' or from the structure of a website')
+    parser.add_argument('--site', help='website URL [http://mg.globalvoicesonline.org]')
+    parser.add_argument('--archives', metavar='YYYY-MM[:YYYY-MM]',
+            help='monthly archive pages of the website between these months')
+    parser.add_argument('--feed-pages', type=int, default=0,
+            help='number of pages of the RSS feed of the website')
+    parser.add_argument('--sitemap', action='store_true', help='sitemap of the website')
+    instrument.add_arguments(parser)
+    args = parser.parse_args()
+    instrument.start(args)
+
+    if args.site:
+        for url in site_seeds(args.site, args.archives, args.feed_pages, args.sitemap):
+            print(url)
+        return
+
     feed = et.parse(sys.stdin)
     for link in feed.findall('//item/link'):
         print(link.text)
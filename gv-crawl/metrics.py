@@ -0,0 +1,167 @@
+'''
+Counters, gauges and latency histograms of a crawl.
+
+They are written periodically to a JSON file and served in the Prometheus
+text format on a local HTTP port, so that the download delay and concurrency
+can be tuned while crawling.
+'''
+import os
+import json
+import time
+import bisect
+import threading
+
+from twisted.internet import reactor, task
+from twisted.python import log
+from twisted.web import server, resource
+
+# Upper bounds (seconds) of the response latency histogram buckets
+latency_buckets = (0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60)
+
+class Histogram(object):
+    '''Histogram of observed values with fixed bucket upper bounds'''
+    def __init__(self, buckets=latency_buckets):
+        self.buckets = buckets
+        self.counts = [0] * len(buckets)
+        self.count = 0
+        self.sum = 0.0
+
+    def observe(self, value):
+        i = bisect.bisect_left(self.buckets, value)
+        if i < len(self.buckets):
+            self.counts[i] += 1
+        self.count += 1
+        self.sum += value
+
+    def cumulative(self):
+        '''-> [(upper bound, number of values <= bound)]'''
+        total, result = 0, []
+        for bound, n in zip(self.buckets, self.counts):
+            total += n
+            result.append((bound, total))
+        return result
+
+class CrawlStats(object):
+    '''Counters, gauges and per-host response latencies of a crawl.
+
+    Counters can be incremented from the background Warc writer thread.
+    '''
+    counters = ('pages', 'not_modified', 'bytes_downloaded', 'records',
+            'bytes_written_raw', 'bytes_written_compressed', 'dedup_hits',
+            'warc_rotations', 'articles', 'extraction_errors')
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.values = dict.fromkeys(self.counters, 0)
+        self.latency = {}
+        self.gauges = {}
+        self.start = time.time()
+
+    def inc(self, name, n=1):
+        with self.lock:
+            self.values[name] += n
+
+    def observe_latency(self, host, seconds):
+        with self.lock:
+            histogram = self.latency.get(host)
+            if histogram is None:
+                histogram = self.latency[host] = Histogram()
+            histogram.observe(seconds)
+
+    def gauge(self, name, function):
+        '''Registers a gauge whose current value is returned by `function`'''
+        self.gauges[name] = function
+
+    def snapshot(self):
+        '''Current values of the counters and gauges -> dict'''
+        with self.lock:
+            stats = dict(self.values)
+            stats['latency'] = dict((host, {'count': h.count, 'sum': h.sum,
+                'mean': h.sum / h.count, 'buckets': h.cumulative()})
+                for host, h in self.latency.iteritems())
+        for name, function in self.gauges.iteritems():
+            # A failing gauge is left out rather than stopping the reporting
+            try:
+                stats[name] = function()
+            except Exception:
+                log.err(_why='Cannot read gauge %s' % name)
+        stats['elapsed'] = time.time() - self.start
+        stats['pages_per_sec'] = stats['pages'] / max(stats['elapsed'], 1e-3)
+        return stats
+
+    def prometheus(self, prefix='gv_crawl_'):
+        '''Current values in the Prometheus text exposition format'''
+        stats = self.snapshot()
+        lines = []
+        def metric(name, metric_type, value):
+            lines.append('# TYPE %s%s %s' % (prefix, name, metric_type))
+            lines.append('%s%s %s' % (prefix, name, value))
+        for name in self.counters:
+            metric(name+'_total', 'counter', stats[name])
+        for name in sorted(self.gauges):
+            if name in stats:
+                metric(name, 'gauge', stats[name])
+        metric('pages_per_second', 'gauge', '%.3f' % stats['pages_per_sec'])
+        name = prefix+'response_latency_seconds'
+        lines.append('# TYPE %s histogram' % name)
+        for host, h in sorted(stats['latency'].iteritems()):
+            for bound, n in h['buckets']:
+                lines.append('%s_bucket{host="%s",le="%g"} %d' % (name, host, bound, n))
+            lines.append('%s_bucket{host="%s",le="+Inf"} %d' % (name, host, h['count']))
+            lines.append('%s_sum{host="%s"} %.6f' % (name, host, h['sum']))
+            lines.append('%s_count{host="%s"} %d' % (name, host, h['count']))
+        return '\n'.join(lines)+'\n'
+
+class MetricsResource(resource.Resource):
+    isLeaf = True
+
+    def __init__(self, stats):
+        resource.Resource.__init__(self)
+        self.stats = stats
+
+    def render_GET(self, request):
+        request.setHeader('Content-Type', 'text/plain; version=0.0.4')
+        return self.stats.prometheus()
+
+class StatsReporter(object):
+    '''Exposes `stats` while the reactor is running.
+
+    `path`      JSON file rewritten every `interval` seconds
+    `port`      Port of the Prometheus endpoint (http://127.0.0.1:port/metrics)
+    `interval`  Number of seconds between two writes of the JSON file
+    '''
+    def __init__(self, stats, path=None, port=None, interval=10):
+        self.stats = stats
+        self.path = path
+        self.port = port
+        self.interval = interval
+        self.loop = self.listener = None
+        self.last = (stats.start, 0)
+
+    def start(self):
+        if self.path:
+            self.loop = task.LoopingCall(self.write)
+            self.loop.start(self.interval, now=False)
+        if self.port:
+            self.listener = reactor.listenTCP(self.port,
+                    server.Site(MetricsResource(self.stats)), interface='127.0.0.1')
+
+    def write(self):
+        '''Writes the current values, with the rate since the previous write'''
+        stats = self.stats.snapshot()
+        now = time.time()
+        last_time, last_pages = self.last
+        stats['recent_pages_per_sec'] = (stats['pages'] - last_pages) / max(now - last_time, 1e-3)
+        self.last = (now, stats['pages'])
+        tmp_path = self.path+'.tmp'
+        with open(tmp_path, 'w') as f:
+            json.dump(stats, f, indent=1, sort_keys=True)
+        os.rename(tmp_path, self.path)
+
+    def stop(self):
+        if self.loop is not None:
+            if self.loop.running: # stopped if a write failed
+                self.loop.stop()
+            self.write()
+        if self.listener is not None:
+            self.listener.stopListening()
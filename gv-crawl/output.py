@@ -0,0 +1,114 @@
+'''
+Buffered output to stdout or to files, optionally gzipped and split into shards.
+'''
+import sys
+import gzip
+import numpy
+
+class OutputWriter(object):
+    '''Writes byte strings to `prefix` (stdout if None).
+
+    `suffix`        Appended to the file names (.gz is added when compressing)
+    `compress`      Gzip the output
+    `shard_size`    Start a new file after this many bytes
+    `sharded`       Name files {prefix}.{n}{suffix}; new_shard() starts the next one
+    `buffer_size`   Number of bytes accumulated before writing
+    '''
+    def __init__(self, prefix=None, suffix='', compress=False, shard_size=None,
+            sharded=False, buffer_size=1024*1024):
+        self.prefix = prefix
+        self.suffix = suffix + ('.gz' if compress else '')
+        self.compress = compress
+        self.shard_size = shard_size
+        self.sharded = sharded or shard_size is not None
+        self.buffer_size = buffer_size
+        self.shard_n = 0
+        self.fp = self.raw_fp = None
+        self.buffer = []
+        self.buffered = self.written = 0
+
+    def _open(self):
+        if self.prefix is None:
+            self.raw_fp = sys.stdout
+        else:
+            fname = self.prefix
+            if self.sharded:
+                fname += '.{}'.format(self.shard_n)
+            self.raw_fp = open(fname+self.suffix, 'wb')
+        self.fp = (gzip.GzipFile(fileobj=self.raw_fp, mode='wb') if self.compress
+                else self.raw_fp)
+
+    def _close_file(self):
+        self.flush()
+        if self.fp is None:
+            return
+        if self.compress:
+            self.fp.close()
+        if self.raw_fp is sys.stdout:
+            self.raw_fp.flush()
+        else:
+            self.raw_fp.close()
+        self.fp = self.raw_fp = None
+
+    def write(self, data):
+        '''Writes `data`; a shard is never split in the middle of a write'''
+        if self.shard_size is not None and self.written >= self.shard_size:
+            self.new_shard()
+        self.buffer.append(data)
+        self.buffered += len(data)
+        self.written += len(data)
+        if self.buffered >= self.buffer_size:
+            self.flush()
+
+    def flush(self):
+        if not self.buffer:
+            return
+        if self.fp is None:
+            self._open()
+        self.fp.write(''.join(self.buffer))
+        self.buffer = []
+        self.buffered = 0
+
+    def new_shard(self):
+        '''Closes the current file; the next write starts a new one'''
+        if self.fp is None and not self.buffer:
+            return
+        self._close_file()
+        self.shard_n += 1
+        self.written = 0
+
+    def close(self):
+        self._close_file()
+
+class HashSet(object):
+    '''Set of 64-bit hashes in an open-addressing NumPy table (8 bytes per slot)'''
+    def __init__(self, capacity=1024*1024):
+        self.table = numpy.zeros(capacity, dtype=numpy.uint64)
+        self.mask = capacity - 1
+        self.size = 0
+
+    def add(self, h):
+        '''Adds a hash -> False if it was already present'''
+        h = (h & 0xFFFFFFFFFFFFFFFF) or 1 # 0 marks empty slots
+        table, mask = self.table, self.mask
+        i = h & mask
+        while True:
+            v = int(table[i])
+            if v == h:
+                return False
+            if v == 0:
+                break
+            i = (i + 1) & mask
+        table[i] = h
+        self.size += 1
+        if 2 * self.size > len(table):
+            self._grow()
+        return True
+
+    def _grow(self):
+        hashes = self.table[self.table != 0]
+        self.table = numpy.zeros(2 * len(self.table), dtype=numpy.uint64)
+        self.mask = len(self.table) - 1
+        self.size = 0
+        for h in hashes:
+            self.add(int(h))
@@ -0,0 +1,302 @@
+# -*- coding: utf-8 -*-
+'''
+Synthetic Global Voices corpus for benchmarks.
+
+Stories are written in a source language and translated into some of the
+other languages. Every version is rendered as a Global Voices page (post
+title, entry with native and foreign quotations, source and translation
+links, date classes) and stored in WARC files like the crawler does. The
+articles can also be inserted directly into an articles database, and the
+sentences of a language pair written in the layout read by align2xml.py.
+'''
+import os
+import json
+import random
+import argparse
+import datetime
+from xml.sax.saxutils import escape, quoteattr
+import warc
+import database
+import instrument
+from articles import Article, article_date
+
+# Frequent words of each language, enough for langid to recognize the sentences
+words = {
+    'en': u'the of and to in is that it was for on are with as they be at one have '
+          u'this from or had by but not what all were we when can said there people '
+          u'government country protest new city about their would after year women'.split(),
+    'fr': u'le la les de des du et à en un une est que qui dans pour pas sur au avec '
+          u'ce il elle nous vous ils sont été être fait plus mais par comme tout leur '
+          u'bien aussi même pays gouvernement peuple ville année femmes'.split(),
+    'es': u'el la los las de del y en un una es que por para con no se su al lo como '
+          u'más pero sus le ya fue este ha porque esta entre cuando muy sin sobre '
+          u'también gobierno país gente ciudad año mujeres'.split(),
+    'pt': u'o a os as de do da e em um uma é que não para com por se na no mais como '
+          u'mas foi ao ele das tem seu sua ou ser quando muito há nos já está também '
+          u'governo país povo cidade ano mulheres'.split(),
+    'mg': u"ny sy ary amin'ny tamin'ny dia izay fa tsy ho an'ny ka izy ireo eto mba "
+          u"koa sady raha nefa mbola efa fanjakana vahoaka firenena olona teny vaovao "
+          u"tao anatin'ny taona vehivavy tanàna".split(),
+    'sw': u'na ya wa kwa katika ni la za kama hii hiyo kuwa watu serikali nchi lakini '
+          u'pia sana habari mwaka baada kwamba yake wao huo hicho mji wanawake '
+          u'maandamano mpya'.split(),
+}
+
+page_template = u'''<!DOCTYPE html>
+<html><head><meta charset="UTF-8"><title>{title} - Global Voices</title></head>
+<body class="{metadata}">
+<div id="header"><ul class="menu"><li><a href="/">Global Voices</a></li></ul></div>
+<div id="main-wrapper">
+<h2 class="post-title" id="post-{id}"><a href={url}>{title}</a></h2>
+{source}<div class="entry">
+{entry}
+</div>
+<div class="post-translations">{translations}</div>
+</div>
+<div id="sidebar"><p>{sidebar}</p></div>
+</body></html>
+'''
+
+def language_url(lang):
+    return 'http://{}globalvoicesonline.org/'.format('' if lang == 'en' else lang+'.')
+
+class Generator(object):
+    '''Random stories, rendered as pages and articles.
+
+    `langs`             Languages of the corpus; stories are written in the first one
+                        or (with probability `original_rate`) in another one
+    `translation_rate`  Probability that a story is translated into each language
+    `paragraphs`        Mean number of paragraphs per article
+    `quote_rate`        Probability that a paragraph is followed by a quotation,
+                        in a foreign language half of the time
+    '''
+    def __init__(self, langs, translation_rate=0.5, paragraphs=8, quote_rate=0.3,
+            original_rate=0.1, seed=1):
+        self.langs = langs
+        self.translation_rate = translation_rate
+        self.paragraphs = paragraphs
+        self.quote_rate = quote_rate
+        self.original_rate = original_rate
+        self.random = random.Random(seed)
+        self.post_ids = dict((lang, 1000) for lang in langs)
+
+    def sentence(self, lang):
+        r = self.random
+        tokens = [r.choice(words[lang]) for _ in xrange(r.randint(6, 20))]
+        if r.random() < 0.1:
+            tokens.insert(r.randrange(len(tokens)), r.choice(('@', '#'))+r.choice(words['en']))
+        tokens[0] = tokens[0].capitalize()
+        return u' '.join(tokens)+r.choice(u'..?!')
+
+    def paragraph(self, lang):
+        return u' '.join(self.sentence(lang) for _ in xrange(self.random.randint(1, 4)))
+
+    def quote(self, lang, depth=0):
+        '''Quotation -> (html, kept text lines)'''
+        r = self.random
+        foreign = r.random() < 0.5
+        quote_lang = r.choice([l for l in self.langs if l != lang]) if foreign else lang
+        text = self.paragraph(quote_lang)
+        inner, lines = '', [text]
+        if depth < 2 and r.random() < 0.2:
+            inner, inner_lines = self.quote(lang, depth+1)
+            lines.extend(inner_lines)
+        if foreign:
+            lines = []
+        return u'<blockquote><p>{}</p>{}</blockquote>'.format(escape(text), inner), lines
+
+    def entry(self, lang):
+        '''Body of an article -> (html, text)'''
+        r = self.random
+        html, lines = [], []
+        for i in xrange(max(1, int(r.gauss(self.paragraphs, self.paragraphs / 3.0)))):
+            text, link = self.paragraph(lang), r.choice(words[lang])
+            html.append(u'<p>{} <strong><a href="http://example.com/{}">{}</a></strong></p>'
+                    .format(escape(text), i, escape(link)))
+            lines.append(text+u' '+link)
+            if r.random() < 0.1:
+                html.append(u'<p><img src="http://example.com/{}.jpg" alt=""/></p>'.format(i))
+            if r.random() < self.quote_rate:
+                quote_html, quote_lines = self.quote(lang)
+                html.append(quote_html)
+                lines.extend(quote_lines)
+        return u'\n'.join(html), u'\n'.join(lines)
+
+    def story(self, n):
+        '''Versions of the n-th story -> [(Article, html)]'''
+        r = self.random
+        original = self.langs[0]
+        if r.random() < self.original_rate:
+            original = r.choice(self.langs)
+        langs = [original] + [l for l in self.langs
+                if l != original and r.random() < self.translation_rate]
+        date = datetime.date(2008, 1, 1) + datetime.timedelta(r.randrange(6 * 365))
+        versions = []
+        for lang in langs:
+            self.post_ids[lang] += 1
+            url = '{}{:%Y/%m/%d}/story-{}/'.format(language_url(lang), date, n)
+            versions.append((lang, self.post_ids[lang], url))
+        source_url = versions[0][2]
+        pages = []
+        for lang, post_id, url in versions:
+            title = self.sentence(lang)[:-1]
+            entry_html, entry = self.entry(lang)
+            metadata = ('single single-post postid-{0} s-y{1:%Y} s-m{1:%m} s-d{1:%d}'
+                    ' s-category-world').format(post_id, date)
+            # Links to translations use the post ID or the full URL
+            links = [(u'{}?p={}'.format(language_url(l), i) if r.random() < 0.3 else u)
+                    for l, i, u in versions if l != lang]
+            source = u''
+            if url != source_url:
+                source = u'<span class="source-link"><a href={}>Original</a></span>\n'.format(
+                        quoteattr(source_url))
+            html = page_template.format(title=escape(title), metadata=metadata, id=post_id,
+                    url=quoteattr(url), source=source, entry=entry_html,
+                    translations=u' '.join(u'<a href={}>{}</a>'.format(quoteattr(link), link)
+                        for link in links),
+                    sidebar=escape(self.paragraph(lang)))
+            article = Article(url, post_id, lang, metadata, ' '.join(links),
+                    source_url if url != source_url else url, title, entry)
+            pages.append((article, html.encode('utf8')))
+        return pages
+
+class WarcSeries(object):
+    '''Writes pages as Warc response records into `outdir`/scrapy.N.warc.gz'''
+    def __init__(self, outdir, max_mb_size=100):
+        self.outdir = outdir
+        self.max_size = max_mb_size * 1024 * 1024
+        self.file_n = 0
+        self.fp = None
+        self.n_records = 0
+
+    def write(self, url, html, date):
+        if self.fp is None:
+            self.file_n += 1
+            self.fp = warc.open(os.path.join(self.outdir,
+                'scrapy.{}.warc.gz'.format(self.file_n)), 'w')
+        http_headers = ('HTTP/1.1 200 OK\r\nContent-Type: text/html; charset=UTF-8\n'
+                'Content-Length: {}\n\r\n').format(len(html))
+        self.fp.write_record(warc.WARCRecord(payload=http_headers + html, headers={
+            'WARC-Type': 'response',
+            'WARC-Date': date,
+            'Content-Length': str(len(http_headers) + len(html)),
+            'Content-Type': 'text/html',
+            'WARC-Target-URI': url}))
+        self.n_records += 1
+        if self.fp.tell() > self.max_size:
+            self.close()
+
+    def close(self):
+        if self.fp is not None:
+            self.fp.close()
+            self.fp = None
+
+class AlignedWriter(object):
+    '''Writes the pairs of a language pair as align2xml.py reads them, one
+    sentence pair per paragraph of the shorter article'''
+    def __init__(self, outdir, src_lang, trg_lang):
+        self.src_lang, self.trg_lang = src_lang, trg_lang
+        align_dir = os.path.join(outdir, 'corpus_data', 'output_data_aligned')
+        info_dir = os.path.join(outdir, 'corpus_to_align')
+        for d in (align_dir, info_dir):
+            if not os.path.exists(d):
+                os.makedirs(d)
+        self.f_doc_info = open(os.path.join(info_dir, 'align_info.txt'), 'w')
+        self.f_src = open(os.path.join(align_dir, 'aligned_sentences_source_language.txt'), 'w')
+        self.f_trg = open(os.path.join(align_dir, 'aligned_sentences_target_language.txt'), 'w')
+        self.f_info = open(os.path.join(align_dir, 'info.txt'), 'w')
+        self.n_pairs = self.n_sentences = 0
+
+    def write(self, articles):
+        by_lang = dict((a.lang, a) for a in articles)
+        src, trg = by_lang.get(self.src_lang), by_lang.get(self.trg_lang)
+        if src is None or trg is None:
+            return
+        self.n_pairs += 1
+        self.f_doc_info.write('{}\t{}\t{}\t{}\n'.format(trg.id, src.url, trg.url,
+            '{:04}-{:02}-{:02}'.format(*article_date(trg.metadata))))
+        for s, t in zip(src.entry.split('\n'), trg.entry.split('\n')):
+            self.f_src.write(s.encode('utf8')+'\n')
+            self.f_trg.write(t.encode('utf8')+'\n')
+            self.f_info.write('{}.txt\t{}.txt\n'.format(trg.id, src.id))
+            self.n_sentences += 1
+
+    def close(self):
+        for f in (self.f_doc_info, self.f_src, self.f_trg, self.f_info):
+            f.close()
+
+def main():
+    parser = argparse.ArgumentParser(description='Generate a synthetic Global Voices corpus')
+    parser.add_argument('outdir', help='directory where the WARC files are written')
+    parser.add_argument('--stories', type=int, default=1000, help='number of stories')
+    parser.add_argument('--langs', default='en,fr,es,mg,sw',
+            help='comma separated languages; stories are mostly written in the first one')
+    parser.add_argument('--translation-rate', type=float, default=0.5,
+            help='probability that a story is translated into each language')
+    parser.add_argument('--paragraphs', type=int, default=8,
+            help='mean number of paragraphs per article')
+    parser.add_argument('--quote-rate', type=float, default=0.3,
+            help='probability that a paragraph is followed by a quotation')
+    parser.add_argument('--warc-mb', type=int, default=100, help='maximum size of the WARC files')
+    parser.add_argument('--no-warc', action='store_true', help='do not write WARC files')
+    parser.add_argument('--database', help='also insert the articles into this database')
+    parser.add_argument('--aligned', nargs=2, metavar=('SRC', 'TRG'),
+            help='also write the articles of a language pair for align2xml.py into outdir')
+    parser.add_argument('--seed', type=int, default=1, help='random seed')
+    instrument.add_arguments(parser)
+    args = parser.parse_args()
+    instrument.start(args)
+
+    langs = args.langs.split(',')
+    unknown = [lang for lang in langs if lang not in words]
+    if unknown:
+        parser.error('no words for languages: {} (available: {})'.format(
+            ', '.join(unknown), ', '.join(sorted(words))))
+
+    if not os.path.exists(args.outdir):
+        os.makedirs(args.outdir)
+    generator = Generator(langs, args.translation_rate, args.paragraphs, args.quote_rate,
+            seed=args.seed)
+    warcs = None if args.no_warc else WarcSeries(args.outdir, args.warc_mb)
+    aligned = AlignedWriter(args.outdir, *args.aligned) if args.aligned else None
+    conn = database.connect(args.database) if args.database else None
+
+    counts = dict((lang, 0) for lang in langs)
+    date = '2013-01-01T00:00:00Z'
+    for n in xrange(args.stories):
+        with instrument.stage('generate'):
+            pages = generator.story(n)
+        for article, html in pages:
+            counts[article.lang] += 1
+            if warcs is not None:
+                with instrument.stage('warc'):
+                    warcs.write(article.url, html, date)
+        articles = [article for article, _ in pages]
+        if conn is not None:
+            with instrument.stage('insert'), conn:
+                database.upsert_articles(conn.cursor(), articles)
+        if aligned is not None:
+            with instrument.stage('aligned'):
+                aligned.write(articles)
+        instrument.count('articles', len(pages))
+
+    # Sizes used by benchmark.py to compute rates
+    manifest = {'stories': args.stories, 'articles': counts,
+            'records': sum(counts.values())}
+    if warcs is not None:
+        warcs.close()
+        manifest['warcs'] = warcs.file_n
+    if aligned is not None:
+        aligned.close()
+        manifest['aligned'] = {'src': aligned.src_lang, 'trg': aligned.trg_lang,
+                'pairs': aligned.n_pairs, 'sentences': aligned.n_sentences}
+    if conn is not None:
+        conn.close()
+    with open(os.path.join(args.outdir, 'synth.json'), 'w') as f:
+        json.dump(manifest, f, indent=1, sort_keys=True)
+
+    print('Articles generated: {} ({})'.format(manifest['records'],
+        ', '.join('{}: {}'.format(lang, counts[lang]) for lang in langs)))
+
+if __name__ == '__main__':
+    main()
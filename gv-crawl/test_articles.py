@@ -0,0 +1,59 @@
+# -*- coding: utf-8 -*-
+'''
+Differential test of the entry text extraction: get_text must give the same
+text as get_text_reference, the previous implementation.
+
+    python -m unittest test_articles
+'''
+import unittest
+import lxml.html
+from articles import get_text, get_text_reference, select_entry
+from synth import Generator
+
+english = u'The government of the country said that the people were in the city.'
+french = u'Le gouvernement du pays a dit que le peuple était dans la ville.'
+
+entries = [
+    # Foreign quotation inside a native one, with tails
+    u'<p>{en}</p><blockquote><p>{en}</p><blockquote>{fr}</blockquote>{en}</blockquote>{en}',
+    # Quotations always removed for their class, inline and as blocks
+    u'<p>{en} <span class="rtl">{en}</span> tail</p><div class="arabic">{en}</div>after',
+    # Translated paragraph, comments and images
+    u'{en}<!-- comment --><p class="translation">{fr}</p><p>{en}<br/>{en}<img src="x"/></p>',
+    # Native quotation with Twitter names and hashtags
+    u'<blockquote>@user {en} #tag</blockquote><p><strong>{en}</strong> {en}</p>',
+    # Foreign inline quotation followed by text of the same paragraph
+    u'<p>{en} <span class="translation">{fr}</span> {en}</p>',
+]
+
+def entry_element(html):
+    doc = lxml.html.document_fromstring(html)
+    return select_entry(doc)[0]
+
+def page(entry):
+    return (u'<html><body><div id="main-wrapper"><div class="entry">{}</div></div>'
+            u'</body></html>').format(entry)
+
+class GetTextTest(unittest.TestCase):
+    def assertSameText(self, html, lang):
+        self.assertEqual(get_text(entry_element(html), lang),
+                get_text_reference(entry_element(html), lang))
+
+    def test_entries(self):
+        for entry in entries:
+            self.assertSameText(page(entry.format(en=english, fr=french)), 'en')
+
+    def test_foreign_quotes_removed(self):
+        text = get_text(entry_element(page(entries[0].format(en=english, fr=french))), 'en')
+        self.assertNotIn(french, text)
+        # The tail of a removed quotation goes with it, as with lxml remove()
+        self.assertEqual(text.count(english), 3)
+
+    def test_synthetic_pages(self):
+        generator = Generator(['en', 'fr', 'mg'], quote_rate=0.5)
+        for n in xrange(50):
+            for article, html in generator.story(n):
+                self.assertSameText(html.decode('utf8'), article.lang)
+
+if __name__ == '__main__':
+    unittest.main()
@@ -1,61 +1,232 @@
 import os
+import zlib
 import glob
 import argparse
 import logging
-import warc
-import sqlite3
-from articles import Article, process_article
-
-create_statement = """create table articles(url text primary key,
-                                             id int,
-                                             lang char(3),
-                                             metadata text,
-                                             translations text,
-                                             source text,
-                                             title text,
-                                             entry text)"""
-
-insert_statement = ('insert into articles('+', '.join(Article._fields)
-        +') values ('+', '.join(['?']*len(Article._fields))+')')
+import multiprocessing
+import warc_index
+import database
+import langident
+import instrument
+from articles import process_article
+
+def read_batches(fn, start, batch_size):
+    """Extract the articles of a WARC file from a given offset, `batch_size` records
+    at a time -> iterator of (articles, end offset of the last record, n_records, n_errors)"""
+    articles = []
+    n_records = n_errors = 0
+    offset = start
+    records = instrument.timed_iter('read', warc_index.read_records(fn, start))
+    while True:
+        try:
+            record, end = next(records)
+        except StopIteration:
+            break
+        except (IOError, zlib.error) as e:
+            if start and offset == start: # offset saved by an older version
+                print('Cannot resume {} at offset {} ({}), reloading it'.format(fn, start, e))
+                for batch in read_batches(fn, 0, batch_size):
+                    yield batch
+                return
+            # The articles read so far are kept, with the offset reached
+            print('Cannot read {} after offset {}: {}'.format(fn, offset, e))
+            break
+        offset = end
+        n_records += 1
+        try:
+            articles.append(process_article(record))
+        except AssertionError as e:
+            n_errors += 1
+            logging.error('{}\t{}'.format(record.url, e))
+        if n_records == batch_size:
+            yield articles, offset, n_records, n_errors
+            articles = []
+            n_records = n_errors = 0
+    yield articles, offset, n_records, n_errors
+
+def file_batches(jobs):
+    """-> iterator of (fn, batch of read_batches, None), and (fn, None, None)
+    when a file is done"""
+    for fn, start, batch_size in jobs:
+        for batch in read_batches(fn, start, batch_size):
+            yield fn, batch, None
+        langident.cache.flush()
+        yield fn, None, None
+
+# Batches read by the pool workers, which wait when the queue is full
+batch_queue = None
+
+def init_worker(queue, langid_cache):
+    global batch_queue
+    batch_queue = queue
+    langident.configure(100000, langid_cache)
+
+def read_articles(job):
+    """Puts the batches of a WARC file in the batch queue, as file_batches
+    does, with instrument.collect() when the file is done"""
+    fn, start, batch_size = job
+    try:
+        for batch in read_batches(fn, start, batch_size):
+            batch_queue.put((fn, batch, None))
+        langident.cache.flush()
+    finally:
+        batch_queue.put((fn, None, instrument.collect()))
+
+def pool_batches(pool, queue, jobs):
+    """file_batches using the processes of a pool"""
+    result = pool.map_async(read_articles, jobs, chunksize=1)
+    n_done = 0
+    while n_done < len(jobs):
+        fn, batch, measures = queue.get()
+        if batch is None:
+            n_done += 1
+        yield fn, batch, measures
+    result.get() # raises the errors of the workers
+
+def reextract_articles(index, urls):
+    """Extract the latest records archived for the given URLs using a WARC index"""
+    articles = []
+    n_records = n_errors = 0
+    for url in urls:
+        location = index.lookup(url)
+        if location is None:
+            n_errors += 1
+            logging.error('{}\tNot in index'.format(url))
+            continue
+        fn, offset, _, _ = location
+        try:
+            with instrument.stage('read'):
+                record = warc_index.read_record(fn, offset)
+        except (IOError, zlib.error) as e:
+            n_errors += 1
+            logging.error('{}\tCannot read {} at offset {}: {}'.format(url, fn, offset, e))
+            continue
+        if record is None:
+            n_errors += 1
+            logging.error('{}\tNo record in {} at offset {}'.format(url, fn, offset))
+            continue
+        n_records += 1
+        try:
+            articles.append(process_article(record))
+        except AssertionError as e:
+            n_errors += 1
+            logging.error('{}\t{}'.format(url, e))
+    return articles, n_records, n_errors
 
 def main():
     parser = argparse.ArgumentParser(description='Load articles into database from WARC files')
-    parser.add_argument('warcs', nargs='+', help='WARC files to load from')
+    parser.add_argument('warcs', nargs='*', help='WARC files to load from')
     parser.add_argument('database', help='database path to insert articles into')
     parser.add_argument('--table', default='global_voices',
             help='table name to insert articles into')
     parser.add_argument('--error', action='store_true',
             help='show errors while processing')
+    parser.add_argument('--workers', type=int, default=1,
+            help='number of processes extracting articles in parallel')
+    parser.add_argument('--batch-size', type=int, default=1000,
+            help='number of records read per batch; the articles of a batch are inserted '
+            'in one transaction')
+    parser.add_argument('--force', action='store_true',
+            help='reload WARC files which have already been loaded')
+    parser.add_argument('--langid-cache',
+            help='database where language identification results are cached')
+    parser.add_argument('--dedup', action='store_true',
+            help='store articles which are the same post as an article already in the '
+            'database (same post ID, same or nearly the same text) as aliases of it')
+    parser.add_argument('--index', help='WARC index to look up --urls in')
+    parser.add_argument('--urls', help='file of URLs to re-extract using --index')
+    instrument.add_arguments(parser)
     args = parser.parse_args()
+    instrument.start(args)
+
+    if args.urls and not args.index:
+        parser.error('--urls requires --index')
 
     logging.basicConfig(level=(logging.WARNING if args.error else logging.CRITICAL))
 
-    db_exists = os.path.exists(args.database)
-    conn = sqlite3.connect(args.database)
+    if args.langid_cache:
+        langident.configure(path=args.langid_cache)
+
+    conn = database.connect(args.database)
     cur = conn.cursor()
 
-    if not db_exists:
-        cur.execute(create_statement)
-        conn.commit()
+    if args.urls:
+        with open(args.urls) as f:
+            urls = [line.strip() for line in f if line.strip()]
+        index = warc_index.WarcIndex(args.index)
+        articles, n_records, n_errors = reextract_articles(index, urls)
+        index.close()
+        langident.cache.flush()
+        with instrument.stage('insert'), conn:
+            n_aliases = database.upsert_articles(cur, articles, args.dedup)
+        instrument.count('records', n_records)
+        instrument.count('articles', len(articles) - n_aliases)
+        print('Records re-extracted: {} ({} errors, {} duplicates => {} inserted)'.format(
+            n_records, n_errors, n_aliases, len(articles) - n_aliases))
 
-    def article_records():
-        for fn in args.warcs:
-            n_records = n_errors = 0
-            print('Processing {}'.format(fn))
-            warc_file = warc.open(fn)
-            for record in warc_file:
-                n_records += 1
-                try:
-                    yield process_article(record)
-                except AssertionError as e:
-                    n_errors += 1
-                    logging.error('{}\t{}'.format(record.url, e))
-            warc_file.close()
-            print('Records processed: {} ({} errors => {} inserted)'.format(n_records,
-                n_errors, n_records - n_errors))
-
-    cur.executemany(insert_statement, article_records())
-    conn.commit()
+    # Skip files which were completely loaded, resume the others
+    jobs, stats = [], {}
+    for fn in args.warcs:
+        path = os.path.abspath(fn)
+        st = os.stat(path)
+        progress = None if args.force else database.warc_progress(cur, path)
+        offset = 0
+        if progress is not None:
+            size, mtime, offset = progress
+            if size == st.st_size and mtime == st.st_mtime and offset >= size:
+                print('Skipping {} (already loaded)'.format(fn))
+                continue
+            if st.st_size < offset: # file was rewritten
+                offset = 0
+            elif offset < st.st_size and not warc_index.is_record_start(path, offset):
+                print('Cannot resume {} at offset {} (not the start of a record), '
+                        'reloading it'.format(fn, offset))
+                offset = 0
+        stats[fn] = (path, st.st_size, st.st_mtime, offset)
+        jobs.append((fn, offset, args.batch_size))
+
+    # WARC files are extracted in parallel; all inserts go through this process
+    if args.workers > 1:
+        queue = multiprocessing.Queue(2 * args.workers)
+        pool = multiprocessing.Pool(args.workers, init_worker, (queue, args.langid_cache))
+        batches = pool_batches(pool, queue, jobs)
+    else:
+        pool = None
+        batches = file_batches(jobs)
+
+    # Articles and the offset reached are committed together, one batch at a time
+    counts = {}
+    for fn, batch, measures in batches:
+        path, size, mtime, start = stats[fn]
+        if fn not in counts:
+            counts[fn] = [0, 0, 0]
+            if start:
+                print('Processing {} (resuming at offset {})'.format(fn, start))
+            else:
+                print('Processing {}'.format(fn))
+        if batch is not None:
+            articles, offset, n_records, n_errors = batch
+            with instrument.stage('insert'), conn:
+                n_aliases = database.upsert_articles(cur, articles, args.dedup)
+                database.set_warc_progress(cur, path, size, mtime, offset)
+            for i, n in enumerate((n_records, n_errors, n_aliases)):
+                counts[fn][i] += n
+            continue
+        if measures is not None:
+            instrument.merge(measures)
+        n_records, n_errors, n_aliases = counts[fn]
+        print('Records processed: {} ({} errors, {} duplicates => {} inserted)'.format(
+            n_records, n_errors, n_aliases, n_records - n_errors - n_aliases))
+        instrument.count('records', n_records)
+        instrument.count('articles', n_records - n_errors - n_aliases)
+
+    if pool is not None:
+        pool.close()
+        pool.join()
+
+    for lang, n_articles, n_counted in database.count_mismatches(cur):
+        print('Monthly counts of {} do not match the articles: {} counted, {} articles'.format(
+            lang, n_counted, n_articles))
 
 if __name__ == '__main__':
     main()
@@ -0,0 +1,132 @@
+'''
+Byte-offset index of the records stored in gzipped WARC files.
+
+Every record is a separate gzip member, so a record can be read back by
+seeking to its offset without decompressing the rest of the file.
+'''
+import os
+import argparse
+import sqlite3
+try:
+    import cStringIO as StringIO
+except ImportError:
+    import StringIO
+import warc
+import instrument
+
+create_statements = ["""create table if not exists records(url text,
+                                                          warc text,
+                                                          offset int,
+                                                          length int,
+                                                          date text)""",
+        'create index if not exists records_url on records(url)',
+        'create index if not exists records_warc on records(warc)']
+
+class WarcIndex(object):
+    '''Maps URLs to (warc file, offset, length, date) for every record.
+
+    WARC paths are stored relative to the directory of the index.
+    '''
+    def __init__(self, path, commit_every=100, check_same_thread=True):
+        self.root = os.path.dirname(os.path.abspath(path))
+        self.conn = sqlite3.connect(path, check_same_thread=check_same_thread)
+        for statement in create_statements:
+            self.conn.execute(statement)
+        self.conn.commit()
+        self.commit_every = commit_every
+        self.pending = 0
+
+    def _relpath(self, fn):
+        return os.path.relpath(os.path.abspath(fn), self.root)
+
+    def add(self, url, fn, offset, length, date):
+        self.conn.execute('insert into records(url, warc, offset, length, date) values (?, ?, ?, ?, ?)',
+                (url, self._relpath(fn), offset, length, date))
+        self.pending += 1
+        if self.pending >= self.commit_every:
+            self.commit()
+
+    def remove_warc(self, fn):
+        self.conn.execute('delete from records where warc = ?', (self._relpath(fn),))
+
+    def lookup(self, url):
+        '''Returns (warc path, offset, length, date) of the latest record for `url`, or None'''
+        row = self.conn.execute('select warc, offset, length, date from records where url = ?'
+                ' order by date desc, rowid desc limit 1', (url,)).fetchone()
+        if row is None:
+            return None
+        fn, offset, length, date = row
+        return os.path.join(self.root, fn), offset, length, date
+
+    def commit(self):
+        self.conn.commit()
+        self.pending = 0
+
+    def close(self):
+        self.commit()
+        self.conn.close()
+
+def _finish_member(gz):
+    '''Reads the end of the current gzip member, so that the file position is
+    the start of the next one. gzip only does it when a read goes past the end
+    of the member: when a read ends just at the end of the compressed data,
+    the position is still in the member.'''
+    while not gz._new_member:
+        try:
+            gz._read(8)
+        except EOFError:
+            break
+
+def read_records(fn, offset=0):
+    '''Iterates over (record, end offset) in a gzipped WARC file, starting at `offset`'''
+    with open(fn, 'rb') as f:
+        f.seek(offset)
+        warc_file = warc.WARCFile(fileobj=f, compress=True)
+        reader = warc_file.reader
+        for record in reader:
+            record.payload = StringIO.StringIO(record.payload.read())
+            reader.finish_reading_current_record()
+            _finish_member(warc_file.fileobj)
+            yield record, warc_file.tell()
+
+def is_record_start(fn, offset):
+    '''Whether a record (gzip member) starts at `offset` in a gzipped WARC file'''
+    with open(fn, 'rb') as f:
+        f.seek(offset)
+        return f.read(2) == '\x1f\x8b'
+
+def read_record(fn, offset):
+    '''Reads the single record stored at `offset` in a gzipped WARC file'''
+    for record, _ in read_records(fn, offset):
+        return record
+
+def index_warc(index, fn):
+    '''Adds all the records of a WARC file to the index -> number of records'''
+    index.remove_warc(fn)
+    n_records = 0
+    offset = 0
+    for record, end in instrument.timed_iter('read', read_records(fn)):
+        index.add(record['WARC-Target-URI'], fn, offset, end - offset, record['WARC-Date'])
+        offset = end
+        n_records += 1
+    index.commit()
+    return n_records
+
+def main():
+    parser = argparse.ArgumentParser(description='Build a byte-offset index of WARC files')
+    parser.add_argument('warcs', nargs='+', help='WARC files to index')
+    parser.add_argument('index', help='index database path')
+    instrument.add_arguments(parser)
+    args = parser.parse_args()
+    instrument.start(args)
+
+    index = WarcIndex(args.index, commit_every=10000)
+    for fn in args.warcs:
+        print('Indexing {}'.format(fn))
+        n_records = index_warc(index, fn)
+        instrument.count('records', n_records)
+        print('Records indexed: {}'.format(n_records))
+    index.close()
+
+if __name__ == '__main__':
+    main()